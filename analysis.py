@@ -0,0 +1,291 @@
+import os
+from contextlib import nullcontext
+import streamlit as st
+import git
+from clone_manager import BLOBLESS, checkout, pinned, repo_key
+from git_history import recent_paths
+from gemini_client import get_model, report_store, stream_generate
+from response_cache import usage_dict
+from token_estimator import calibrate, estimate_prompt_tokens
+from ingestion import format_skip_report, list_repo_files, read_repo_parts
+from async_llm import map_chunks
+from prompt_packer import plan_chunks, prompt_budget
+from tracing import count
+from compaction import default_compactor
+from chat import CHAT_INSTRUCTION, CHAT_MODEL, CHAT_RETRIEVAL, RepoContext, retrieval_context
+
+# Step 1: Load the model (configured once per server process, see gemini_client.get_model)
+print("Loading Gemini 1.5 flash model...")
+generation_config = {
+  "temperature": 0.5,
+  "top_p": 0.95,
+  "top_k": 64,
+  "max_output_tokens": 8192,
+#   "max_input_tokens": 1000000,
+  "response_mime_type": "text/plain",
+}
+
+llm = get_model("gemini-1.5-flash", generation_config)
+
+
+# Files of one commit of a repository planned against the input budget, kept across reruns and
+# sessions; head_sha is only part of the cache key. A repo that fits in one chunk is read into
+# prompt parts here, larger ones are read chunk by chunk in the map step. The last value is the
+# compaction summary of the parts, or None when compaction is off or the parts are not read yet.
+@st.cache_resource(show_spinner=False, max_entries=16)
+def ingest_repository(local_path, head_sha, budget, spill_file):
+    skip_report = {}
+    entries = list_repo_files(git.Repo(local_path), skip_report)
+    chunks, skipped = plan_chunks(entries, budget, recent_paths(local_path), model_name=llm.model_name)
+    parts = []
+    compaction = None
+    if len(chunks) <= 1:
+        compactor = default_compactor()
+        parts = read_repo_parts(local_path, spill_file, chunks[0] if chunks else [], skip_report, compactor=compactor)
+        if compactor is not None:
+            compaction = compactor.summary()
+    return chunks, skipped, parts, skip_report, compaction
+
+
+# Where analyses keep their clone of a repository
+def local_repo_path(repo_url):
+    return './repo/' + repo_key(repo_url)
+
+
+# Context for follow-up questions about one commit of a cloned repository, shared by every session.
+# A repository larger than the chat model's input window is searched for every question instead.
+@st.cache_resource(show_spinner=False, max_entries=8)
+def chat_context(local_path, head_sha):
+    entries = list_repo_files(git.Repo(local_path))
+    budget = prompt_budget(CHAT_MODEL, CHAT_INSTRUCTION)
+    chunks, _ = plan_chunks(entries, budget, recent_paths(local_path), model_name=CHAT_MODEL)
+    if CHAT_RETRIEVAL == "always" or CHAT_RETRIEVAL == "auto" and len(chunks) > 1:
+        return retrieval_context(local_path, generation_config)
+    parts = read_repo_parts(local_path, None, chunks[0] if chunks else [], compactor=default_compactor())
+    return RepoContext(parts, generation_config)
+
+
+# chat_context for the current checkout of an analysed repository
+def repository_chat(repo_url):
+    local_path = local_repo_path(repo_url)
+    with pinned(local_path):
+        return chat_context(local_path, git.Repo(local_path).head.commit.hexsha)
+
+
+# Clone or update repo_url and generate the technical and non-technical reports for its HEAD.
+# Runs on a jobs.JobQueue worker or a batch_cli.py process: progress(message) reports each step and
+# on_text(text) receives the report as it streams. model_slot, a lock or semaphore, is held during
+# the model calls to limit how many analyses call the model at once. Returns the report text, token
+# usage and the analysed commit. The checkout stays pinned against eviction until the report is done.
+def analyse_repository(progress, on_text, repo_url, model_slot=None):
+    local_path = local_repo_path(repo_url)
+    with pinned(local_path):
+        return _analyse_checkout(progress, on_text, repo_url, local_path, model_slot or nullcontext())
+
+
+def _analyse_checkout(progress, on_text, repo_url, local_path, model_slot):
+    output_file = local_path + '_output.txt'
+
+    # Step 2: Clone the repository (blobless: history plus the checked out files only),
+    # or fetch what changed if it is already cloned
+    print("Cloning Repository...")
+    progress("Cloning repository...")
+    try:
+        checkout(repo_url, local_path, mode=BLOBLESS)
+    except Exception as e:
+        print(f"Error cloning repository: {e}")
+        progress(f"Error cloning repository: {e}")
+        raise
+
+    # Output Format of LLM
+    non_technical_output_format = """Non-Technical Report (For Management/Stakeholders)
+        Repository Health Report
+
+        Repository: [Insert Repository Name Here]
+
+        I. Introduction
+        This report summarizes the health and activity level of the code repository [Repository Name Here].
+
+        II. Code Quality Assessment
+        Our code analysis tools have evaluated the overall quality of the codebase. While a detailed technical report is available for developers, here's a high-level overview:
+
+        Overall Score: [Score (e.g., Green, Yellow, Red) with explanation] - This score indicates the general health of the code, with green signifying good quality, 
+        yellow suggesting areas for improvement, and red highlighting potential issues.
+        Maintainability: The code is assessed for ease of understanding and modification.
+        
+        III. Activity Level
+        This report analyzes the development activity within the repository:
+
+        Development Pace: We track the frequency of code commits to understand the development team's activity level.
+        Collaboration: The report examines the number of active branches and pull requests, indicating collaboration between developers.
+        
+        IV. Actionable Insights
+        The report highlights any potential code quality concerns that might require developer attention.
+        Based on the activity level, the report might suggest adjustments to development workflows for optimal efficiency.
+        
+        V. Benefits
+        Maintaining a healthy codebase is crucial for long-term project success. This analysis helps us:
+        Identify areas for improvement in code quality and maintainability.
+        Ensure efficient development processes and collaboration.
+        Reduce the risk of bugs and technical issues down the line.
+        
+        VI. Next Steps
+        The development team will review the detailed technical report for specific recommendations.
+        We might implement code review practices to further enhance code quality.
+        We will continue to monitor the repository health and make adjustments as needed.
+        """
+    technical_output_format = """
+    Structured Output Format:
+    ## <Repository Name> Codebase Analysis Report
+
+    This report provides an in-depth analysis of the <Repo name> <techstack> application codebase, 
+    focusing on key aspects such as repository activity, code quality, and adherence to best practices.
+    and provides filenames and line numbers for specific issues and recommendations for improvement.
+
+    **1. Repository Metadata:**
+
+    * **Commits:** <Info about Commit>
+    * **Branches:** <Info About Branches>
+    * **Contributors:**  <Info about contributers>
+
+    **2. Code Quality & Best Practices Evaluation:**
+
+    * **Code Quality:** 
+        * **Positive:** <detail about code quality>.
+        * **Areas for Improvement:**  <areas where the code could be improved> 
+    * **Activity Level:**  
+        * <Repository activity>
+    * **Refactoring Suggestions:**  
+        *  <Refactoring Suggestion>
+    * **DRY Principle:** 
+        *  <Feedback about the code following DRY principle>
+
+    **3. Insights:**
+    - Using its understanding of coding best practices, you have to evaluate code quality based on factors like syntax, error frequency, and use of best practices.
+    - you should assess the activity level by analyzing commit frequency, number of active branches, and recent pull requests.
+    - You will suggest refactoring opportunities by identifying code duplications, complex methods, or inefficient algorithms.
+    - Adherence to principles like DRY (Don’t Repeat Yourself) will be evaluated by detecting repeated code blocks and 
+      suggesting optimizations refactoring opportunities, and DRY principle adherence is limited due to the small code sample.
+
+    **4. Recommendations:**
+
+    * **Code Review & Testing:** As the project evolves, prioritize regular code reviews and thorough testing to maintain code quality and identify potential issues early.
+    * **Refactoring & Optimization:**  Continuously monitor for code duplication and complexity, implementing refactoring techniques as needed to enhance code maintainability and efficiency.
+    * **Collaboration:**  Consider inviting more contributors or seeking feedback from the Rails community to foster diverse perspectives and enhance code quality.
+    """
+    # Disclaimer:
+    # This report is a preliminary analysis based on the current state of the repository. Further manual code review might reveal additional areas for improvement"""
+    # Define prompt for Generative AI model; the repository parts go between the head and tail
+    prompt_intro = """The Betacraft AI
+
+        You are a powerful large language model (LLM) trained on a massive dataset of code repositories and best practices. 
+        People call you the "Betacraft AI" because you can analyze entire codebases, understand their structure, and answer questions about their quality, 
+        activity level, and potential improvements.
+
+        A New Codebase Arrives!
+
+"""
+    prompt_head = prompt_intro + """        A developer has pushed a new codebase, ```"""
+    prompt_tail = f"""```, for your analysis,
+        
+        They are particularly concerned about:
+        Code Quality: Is the code clean, well-written, and free of errors and inefficiencies?
+        Maintainability: How easy is it to understand and modify the code?
+        Efficiency: Can the code be optimized for better performance?
+        
+        Generate Reports for Everyone
+
+        Use your knowledge of coding best practices to analyze the repository and generate two reports:
+
+
+        1. Technical Report in the ```{technical_output_format}``` format.
+        2. Non-Technical Report in the ```{non_technical_output_format}``` format.
+
+        replace [] with the real values of the code in the output formats specified above
+        Provide the developer with actionable feedback in their preferred format (technical or non-technical) to help them improve their codebase. 
+        By offering insights and suggestions, you can be their trusted "Betacraft AI".
+    """ 
+    # Prompts for repositories larger than the input window: each ranked chunk is reviewed on its
+    # own (map) and the notes are merged into the usual two reports (reduce)
+    map_prompt_head = """You are the Betacraft AI, reviewing one part of a codebase that is too large to read at once.
+        Write concise notes for a later whole-repository report: the tech stack, code quality problems with
+        file names and line numbers, error-prone or inefficient code, refactoring opportunities and duplicated code.
+        Do not write the final report.
+
+        Files: ```"""
+    map_prompt_tail = """```
+    """
+    reduce_head = prompt_intro + """        A developer has pushed a new codebase that is too large to read at once.
+        It was reviewed in parts and the notes from every part are in the following ```"""
+
+    # Process the files in the repository, planning them against the model's input window
+    print("Processing files...")
+    progress("Reading files...")
+    try:
+        head_sha = git.Repo(local_path).head.commit.hexsha
+        budget = prompt_budget(llm.model_name, prompt_head, prompt_tail)
+        # Spill to the output file for very large repos
+        spill_file = output_file if os.getenv("INGEST_SPILL") else None
+        chunks, skipped, parts, skip_report, compaction = ingest_repository(local_path, head_sha, budget, spill_file)
+        # The map step adds to the report, so work on a copy of the cached one
+        skip_report = {reason: list(paths) for reason, paths in skip_report.items()}
+        progress("Files read successfully.")
+    except Exception as e:
+        progress(f"Error reading files: {e}\n\n")
+        raise
+    if skipped:
+        progress(f"{len(skipped)} files did not fit the model's input window and were left out.")
+
+    reports = report_store()
+    report_key = (os.path.abspath(local_path), head_sha, llm.model_name)
+    response = reports.get(report_key)
+    if response is not None:
+        print("Report for this commit already generated")
+        progress("This commit was already analysed, showing the earlier report.")
+        on_text(response.text)
+    else:
+        if len(chunks) <= 1:
+            prompt = [prompt_head, *parts, prompt_tail]
+        else:
+            print(f"Analysing {len(chunks)} parts...")
+            progress(f"Repository is larger than the model's input window, analysing it in {len(chunks)} parts...")
+            compactor = default_compactor()
+            with model_slot:
+                notes = map_chunks(llm, (
+                    [map_prompt_head, *read_repo_parts(local_path, None, chunk, skip_report, compactor=compactor), map_prompt_tail]
+                    for chunk in chunks
+                ))
+            prompt = [reduce_head, *notes, prompt_tail]
+            if compactor is not None:
+                compaction = compactor.summary()
+        if skip_report:
+            progress(format_skip_report(skip_report))
+        if compaction:
+            progress(compaction)
+
+        # Generate response from Generative AI model
+        print("Generating response...")
+        progress("Waiting for Gemini response...")
+        # Estimated locally; the exact counts come back with the response
+        estimated_tokens = estimate_prompt_tokens(prompt, llm.model_name)
+        count("estimated_tokens", estimated_tokens)
+        progress(f"Estimated input tokens: {estimated_tokens}")
+
+        # Stream the report as it is generated; errors fail the job
+        with model_slot:
+            response = stream_generate(llm, prompt, on_text)
+        calibrate(llm.model_name, prompt, response.usage_metadata.prompt_token_count)
+        count("prompt_tokens", response.usage_metadata.prompt_token_count or 0)
+        count("output_tokens", response.usage_metadata.candidates_token_count or 0)
+        if response.complete:
+            reports[report_key] = response
+        else:
+            progress(f"The response stopped early ({response.finish_reason}), it is not kept for this commit.")
+
+    usage = usage_dict(response.usage_metadata)
+    progress(f"Input tokens: {usage['prompt_token_count']}")
+    progress(f"Output tokens: {usage['candidates_token_count']}")
+    progress(f"Total tokens: {usage['total_token_count']}")
+    print("Total tokens: ", usage['total_token_count'])
+    print("Gemini response successfully generated")
+    return {"text": response.text, "usage": usage, "head_sha": head_sha}
@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import response_cache
+from token_estimator import calibrate, estimate_prompt_tokens
+from tracing import count, traced
+
+# Gemini quota the concurrent calls have to stay within (defaults match the gemini-1.5-flash free tier)
+REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_RPM", 15))
+TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TPM", 1000000))
+# Calls in flight at the same time
+CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 8))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 5))
+
+
+# Token buckets for requests and tokens per minute. After a 429 the rate is halved and then
+# recovers a little with every successful call, so the limiter settles just under the real quota.
+# One limiter is shared by the event loops and threads of a process, see default_limiter().
+class RateLimiter:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.scale = 1.0
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        # A share of the quota can be under one request a minute; the bucket still holds one
+        self.requests = min(max(self.requests_per_minute, 1), self.requests + elapsed * self.requests_per_minute * self.scale / 60)
+        self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute * self.scale / 60)
+
+    # Take one request of the given size if it fits in both buckets and return 0, otherwise return
+    # the seconds until it will
+    def _take(self, tokens):
+        tokens = min(tokens, self.tokens_per_minute)
+        with self.lock:
+            self._refill()
+            if self.requests >= 1 and self.tokens >= tokens:
+                self.requests -= 1
+                self.tokens -= tokens
+                return 0
+            wait = max(
+                (1 - self.requests) * 60 / (self.requests_per_minute * self.scale),
+                (tokens - self.tokens) * 60 / (self.tokens_per_minute * self.scale),
+            )
+            return max(wait, 0.01)
+
+    # Wait until one request of the given size fits in both buckets, then take it
+    async def acquire(self, tokens):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    # acquire() for blocking callers such as the streamed calls
+    def wait(self, tokens):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def throttled(self):
+        self.scale = max(self.scale / 2, 0.05)
+
+    def succeeded(self):
+        self.scale = min(self.scale * 1.1, 1.0)
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+# The rate limiter shared by every model call of this process
+def default_limiter():
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
+
+
+# Replace the limiter of this process, e.g. with its share of the quota in a worker process
+def set_default_limiter(limiter):
+    global _default_limiter
+    with _default_lock:
+        _default_limiter = limiter
+
+
+# google-generativeai has no async client for the REST transport that GEMINI_API_ENDPOINT selects
+# (see gemini_client.get_model), so those models are called on a worker thread like sync ones
+def _has_async(llm):
+    return hasattr(llm, "generate_content_async") and not os.getenv("GEMINI_API_ENDPOINT")
+
+
+def _is_rate_limited(error):
+    return getattr(error, "code", None) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+# Seconds to wait before retry number attempt + 1 of a rate-limited call
+def _backoff(attempt):
+    return min(2 ** attempt, 60) * (0.5 + random.random())
+
+
+# Blocking model call within the shared rate limits, retried with the same backoff as generate()
+# on 429s. call() makes the whole request (a streamed one is started over) and its result is returned.
+def call_limited(call, tokens, limiter=None, max_retries=MAX_RETRIES):
+    limiter = limiter or default_limiter()
+    for attempt in range(max_retries + 1):
+        limiter.wait(tokens)
+        try:
+            result = call()
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == max_retries:
+                raise
+            limiter.throttled()
+            count("retries")
+            delay = _backoff(attempt)
+            print(f"Rate limited by Gemini, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        limiter.succeeded()
+        count("model_calls")
+        return result
+
+
+# One model call within the rate limits, retried with exponential backoff and jitter on 429s.
+# Cached responses are returned without touching the limiter; models without a usable
+# generate_content_async are called on a worker thread.
+async def generate(llm, prompt, limiter, max_retries=MAX_RETRIES):
+    key = response_cache.cache_key(llm, prompt)
+    cached = response_cache.load(key)
+    if cached is not None:
+        return cached
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(estimate_prompt_tokens(prompt, llm.model_name))
+        try:
+            if _has_async(llm):
+                response = await llm.generate_content_async(prompt)
+            else:
+                response = await asyncio.to_thread(llm.generate_content, prompt)
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == max_retries:
+                raise
+            limiter.throttled()
+            count("retries")
+            delay = _backoff(attempt)
+            print(f"Rate limited by Gemini, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        limiter.succeeded()
+        count("model_calls")
+        count("prompt_tokens", getattr(response.usage_metadata, "prompt_token_count", 0) or 0)
+        calibrate(llm.model_name, prompt, getattr(response.usage_metadata, "prompt_token_count", 0))
+        response_cache.store(key, response)
+        return response
+
+
+# Run every prompt with at most `concurrency` calls in flight and return the responses in order.
+# Prompts are taken from the iterable only when a worker is free, so a generator of large chunk
+# prompts is never fully in memory.
+async def generate_all(llm, prompts, limiter=None, concurrency=CONCURRENCY):
+    limiter = limiter or default_limiter()
+    pending = enumerate(prompts)
+    responses = {}
+
+    async def worker():
+        for index, prompt in pending:
+            responses[index] = await generate(llm, prompt, limiter)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return [responses[index] for index in sorted(responses)]
+
+
+# Blocking entry point for the Streamlit scripts
+def run_all(llm, prompts, limiter=None, concurrency=CONCURRENCY):
+    return asyncio.run(generate_all(llm, prompts, limiter, concurrency))
+
+
+# Map step of a map-reduce analysis (see prompt_packer.plan_chunks): analyse every chunk prompt
+# concurrently and return the notes, which the caller merges into the final report with one more call
+@traced("map_chunks")
+def map_chunks(llm, chunk_prompts, limiter=None, concurrency=CONCURRENCY):
+    responses = run_all(llm, chunk_prompts, limiter, concurrency)
+    return [f"\n\n### Part {index + 1}\n\n{response.text}" for index, response in enumerate(responses)]
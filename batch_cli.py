@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from clone_manager import repo_key
+from async_llm import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, RateLimiter, set_default_limiter
+
+# Analyse many repositories without the Streamlit pages: every repository in a manifest is cloned,
+# ingested and analysed (analysis.analyse_repository) on a pool of worker processes, with at most
+# --model-concurrency of them calling the model at a time. Each report is written to the output
+# directory as <name>.md next to <name>.json holding its status, so an interrupted run picks up
+# where it stopped: finished repositories are skipped, failed ones only retried with --retry-failed.
+# Usage: python batch_cli.py repos.txt [--out reports] [--workers N] [--model-concurrency N] [--retry-failed]
+# The manifest has one repository URL per line; blank lines and lines starting with # are ignored.
+# The Gemini rate limits of async_llm (GEMINI_RPM, GEMINI_TPM) are split evenly between the worker processes.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 4))
+BATCH_MODEL_CONCURRENCY = int(os.getenv("BATCH_MODEL_CONCURRENCY", 4))
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Semaphore shared by the worker processes, set by _init_worker
+_model_slot = None
+
+
+# Repository URLs of a manifest in order, without duplicates
+def read_manifest(manifest_file):
+    urls = []
+    with open(manifest_file, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#") and line not in urls:
+                urls.append(line)
+    return urls
+
+
+# File name for a repository's outputs, the same "org__repo" key as its checkout
+def report_name(repo_url):
+    return repo_key(repo_url)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as outfile:
+        json.dump(data, outfile, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_status(out_dir, repo_url):
+    try:
+        with open(os.path.join(out_dir, report_name(repo_url) + ".json"), 'r', encoding='utf-8') as status_file:
+            return json.load(status_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _init_worker(model_slot, processes):
+    global _model_slot
+    _model_slot = model_slot
+    set_default_limiter(RateLimiter(REQUESTS_PER_MINUTE / processes, TOKENS_PER_MINUTE / processes))
+
+
+# Analyse one repository in a worker process and write its report and status. Progress goes to
+# <name>.log. Returns the status.
+def analyse_one(repo_url, out_dir):
+    # Imported here so the model is configured in each worker process, not in the parent
+    from analysis import analyse_repository
+
+    name = report_name(repo_url)
+    status_path = os.path.join(out_dir, name + ".json")
+    status = {"repo_url": repo_url, "status": RUNNING, "started": time.time(), "pid": os.getpid()}
+    _write_json(status_path, status)
+    with open(os.path.join(out_dir, name + ".log"), 'w', encoding='utf-8') as log_file:
+        def progress(message):
+            print(f"[{name}] {message}")
+            log_file.write(message + "\n")
+            log_file.flush()
+
+        try:
+            result = analyse_repository(progress, lambda text: None, repo_url, model_slot=_model_slot)
+        except Exception as e:
+            log_file.write(traceback.format_exc())
+            status.update(status=FAILED, error=str(e), finished=time.time())
+            _write_json(status_path, status)
+            return status
+
+    report_path = os.path.join(out_dir, name + ".md")
+    tmp_path = f"{report_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as report_file:
+        report_file.write(result["text"])
+    os.replace(tmp_path, report_path)
+    status.update(status=DONE, usage=result["usage"], head_sha=result.get("head_sha"), finished=time.time())
+    _write_json(status_path, status)
+    return status
+
+
+# Repositories of the manifest still to analyse: never started, interrupted, or failed when
+# retry_failed is set
+def pending_repos(urls, out_dir, retry_failed=False):
+    pending = []
+    for repo_url in urls:
+        status = load_status(out_dir, repo_url)
+        if status is None or status["status"] == RUNNING or status["status"] == FAILED and retry_failed:
+            pending.append(repo_url)
+    return pending
+
+
+def run_batch(urls, out_dir, workers=BATCH_WORKERS, model_concurrency=BATCH_MODEL_CONCURRENCY, retry_failed=False):
+    os.makedirs(out_dir, exist_ok=True)
+    pending = pending_repos(urls, out_dir, retry_failed)
+    print(f"{len(urls) - len(pending)} of {len(urls)} repositories already analysed, {len(pending)} to go")
+    if not pending:
+        return []
+    context = multiprocessing.get_context()
+    model_slot = context.BoundedSemaphore(model_concurrency)
+    start = time.time()
+    results = []
+    processes = min(workers, len(pending))
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                   initializer=_init_worker, initargs=(model_slot, processes))
+    try:
+        futures = {executor.submit(analyse_one, repo_url, out_dir): repo_url for repo_url in pending}
+        for future in as_completed(futures):
+            repo_url = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                # The worker process died; the status file still says running, so it is retried next run
+                print(f"Error analysing {repo_url}: {e}")
+                continue
+            results.append(status)
+            print(f"{len(results)}/{len(pending)} {repo_url}: {status['status']}"
+                  + (f" ({status['error']})" if status["status"] == FAILED else ""))
+    except KeyboardInterrupt:
+        print("Interrupted, run again to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    done = [status for status in results if status["status"] == DONE]
+    tokens = sum(status["usage"]["total_token_count"] for status in done)
+    print(f"Analysed {len(done)} repositories, {len(results) - len(done)} failed, "
+          f"{tokens} tokens in {time.time() - start:.0f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse the repositories of a manifest and write the reports to disk")
+    parser.add_argument("manifest", help="file with one repository URL per line")
+    parser.add_argument("--out", default="./reports", help="directory for the reports and their status")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="repositories cloned and ingested at once")
+    parser.add_argument("--model-concurrency", type=int, default=BATCH_MODEL_CONCURRENCY,
+                        help="analyses calling the model at once")
+    parser.add_argument("--retry-failed", action="store_true", help="analyse repositories that failed before again")
+    args = parser.parse_args()
+
+    results = run_batch(read_manifest(args.manifest), args.out, args.workers, args.model_concurrency, args.retry_failed)
+    if any(status["status"] == FAILED for status in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
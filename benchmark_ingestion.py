@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import git
+import ingestion
+
+# Compare serial and thread pool ingestion of a repository with a cold snapshot cache.
+# Usage: python benchmark_ingestion.py [repo_path] [--files N] [--workers 1,4,8,16] [--latency-ms 2]
+# Without repo_path a synthetic repository with N files is created in a temporary directory.
+# --latency-ms adds a delay to every file read to mimic a network filesystem.
+
+
+def make_synthetic_repo(path, files):
+    repo = git.Repo.init(path)
+    for index in range(files):
+        directory = os.path.join(path, f"pkg{index % 100}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"module{index}.py"), 'w', encoding='utf-8') as outfile:
+            outfile.write(f"def function_{index}(value):\n    return value * {index}\n" * 40)
+    repo.git.add("--all")
+    actor = git.Actor("Benchmark", "benchmark@example.com")
+    repo.index.commit("Synthetic repository", author=actor, committer=actor)
+    return path
+
+
+def with_latency(read, latency):
+    def read_slowly(*args):
+        time.sleep(latency)
+        return read(*args)
+    return read_slowly
+
+
+# Seconds to ingest repo_path with the given number of workers, starting from an empty cache
+def time_ingestion(repo_path, entries, workers):
+    cache_dir = tempfile.mkdtemp(prefix="snapshot_cache_")
+    ingestion.SNAPSHOT_CACHE_DIR = cache_dir
+    try:
+        start = time.perf_counter()
+        parts = ingestion.read_repo_parts(repo_path, entries=entries, workers=workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return elapsed, parts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs parallel ingestion benchmark")
+    parser.add_argument("repo_path", nargs="?")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--workers", default="1,4,8,16")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    scratch = None
+    repo_path = args.repo_path
+    if repo_path is None:
+        scratch = tempfile.mkdtemp(prefix="ingestion_benchmark_")
+        print(f"Creating a synthetic repository with {args.files} files...")
+        repo_path = make_synthetic_repo(scratch, args.files)
+    if args.latency_ms:
+        ingestion.read_blob_text = with_latency(ingestion.read_blob_text, args.latency_ms / 1000)
+
+    try:
+        entries = ingestion.list_repo_files(git.Repo(repo_path))
+        print(f"{len(entries)} files in {repo_path}")
+        baseline = None
+        expected = None
+        for workers in [int(value) for value in args.workers.split(",")]:
+            elapsed, parts = time_ingestion(repo_path, entries, workers)
+            if expected is None:
+                baseline, expected = elapsed, parts
+            elif parts != expected:
+                print(f"Output with {workers} workers differs from the first run")
+                sys.exit(1)
+            print(f"workers={workers:<3} {elapsed:8.3f}s  speedup x{baseline / elapsed:.2f}")
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import git
+import ingestion
+import clone_manager
+import response_cache
+from async_llm import map_chunks
+from gemini_client import get_model
+from compaction import Compactor
+from git_history import batch_reader, read_history
+from prompt_packer import plan_chunks, prompt_budget
+from token_estimator import estimate_prompt_tokens
+from fake_gemini import FakeGeminiServer
+
+# End-to-end benchmarks on a synthetic repository: whole-repo ingestion, chunk planning, the
+# shallow clone and commit-window prompt of the weekly reports, and report generation against
+# fake_gemini.py, including the concurrent map step of large repositories. Every stage reports wall time, peak Python memory, bytes read
+# from the repository, bytes served by the snapshot cache and estimated tokens.
+# Usage: python benchmark_suite.py [--files N] [--file-size BYTES] [--binaries N] [--commits N]
+#            [--latency-ms MS] [--json results.json] [--compare baseline.json --tolerance 0.25]
+# With --compare the run fails when a stage is slower or uses more memory than the baseline
+# by more than the tolerance.
+
+SOURCE_LINE = "    result = compute_value(item, index) + offset  # synthetic line {}\n"
+
+
+# Create a repository with `files` text files of about file_size bytes, `binaries` binary files,
+# and `commits` more commits each changing files_per_commit files, spread over the last six days
+def make_synthetic_repo(path, files=1000, file_size=2048, binaries=20, commits=20, files_per_commit=10, seed=0):
+    rng = random.Random(seed)
+    repo = git.Repo.init(path)
+    actor = git.Actor("Benchmark", "benchmark@example.com")
+    paths = []
+    for index in range(files):
+        file_path = os.path.join(f"pkg{index % 50}", f"module{index}.py")
+        os.makedirs(os.path.join(path, os.path.dirname(file_path)), exist_ok=True)
+        lines = [f"def function_{index}(item, offset):\n"]
+        while sum(len(line) for line in lines) < file_size:
+            lines.append(SOURCE_LINE.format(rng.randrange(1 << 30)))
+        with open(os.path.join(path, file_path), 'w', encoding='utf-8') as outfile:
+            outfile.writelines(lines)
+        paths.append(file_path)
+    os.makedirs(os.path.join(path, "assets"), exist_ok=True)
+    for index in range(binaries):
+        with open(os.path.join(path, "assets", f"blob{index}.dat"), 'wb') as outfile:
+            outfile.write(b"\0" + rng.randbytes(file_size))
+    repo.git.add("--all")
+    # Dates in git's raw "<unix time> <offset>" format
+    start = time.time() - 6 * 24 * 3600
+    date = f"{int(start)} +0000"
+    repo.index.commit("Initial commit", author=actor, committer=actor, author_date=date, commit_date=date)
+
+    for number in range(commits):
+        changed = rng.sample(paths, min(files_per_commit, len(paths)))
+        for file_path in changed:
+            with open(os.path.join(path, file_path), 'a', encoding='utf-8') as outfile:
+                outfile.write(SOURCE_LINE.format(rng.randrange(1 << 30)))
+        repo.index.add(changed)
+        date = f"{int(start + 5 * 24 * 3600 * (number + 1) / commits)} +0000"
+        repo.index.commit(f"Change {number + 1}", author=actor, committer=actor, author_date=date, commit_date=date)
+    return path
+
+
+# Run fn and return its result with a row of measurements. fn returns (result, bytes read, prompt);
+# stages that read files through ingestion return None and get the bytes it actually read, so cache
+# hits show up as cache bytes instead of bytes read
+def measure(stage, fn):
+    before = ingestion.bytes_read()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result, bytes_read, prompt = fn()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    after = ingestion.bytes_read()
+    if bytes_read is None:
+        bytes_read = after["files"] - before["files"]
+    cache_bytes = after["cache"] - before["cache"]
+    row = {
+        "stage": stage,
+        "wall_seconds": round(elapsed, 4),
+        "peak_bytes": peak,
+        "bytes_read": bytes_read,
+        "cache_bytes": cache_bytes,
+        "estimated_tokens": estimate_prompt_tokens(prompt) if prompt else 0,
+    }
+    print(f"{stage:<28} {elapsed:9.3f}s {peak / 1e6:9.1f} MB {bytes_read / 1e6:9.1f} MB read {cache_bytes / 1e6:9.1f} MB cached {row['estimated_tokens']:>10} tokens")
+    return result, row
+
+
+def run_suite(repo_path, scratch, latency):
+    rows = []
+    repo = git.Repo(repo_path)
+    entries = ingestion.list_repo_files(repo)
+
+    def ingest():
+        parts = ingestion.read_repo_parts(repo_path, entries=entries)
+        return parts, None, parts
+
+    def plan():
+        return plan_chunks(entries, prompt_budget("gemini-1.5-flash"), model_name="gemini-1.5-flash"), 0, None
+
+    ingestion.SNAPSHOT_CACHE_DIR = os.path.join(scratch, "snapshot_cache")
+    rows.append(measure("ingest (cold cache)", ingest)[1])
+    rows.append(measure("ingest (warm cache)", ingest)[1])
+
+    def compacted():
+        parts = ingestion.read_repo_parts(repo_path, entries=entries, compactor=Compactor())
+        return parts, None, parts
+
+    rows.append(measure("ingest (compacted)", compacted)[1])
+    rows.append(measure("plan chunks", plan)[1])
+
+    # The weekly reports clone shallowly and read the last week's commits
+    clone_manager.CLONE_INDEX_FILE = os.path.join(scratch, "clone_index.json")
+    clone_path = os.path.join(scratch, "clone")
+    last_week = datetime.datetime.now() - datetime.timedelta(weeks=1)
+
+    def clone():
+        url = "file://" + os.path.abspath(repo_path)
+        clone_manager.checkout(url, clone_path, clone_manager.SHALLOW, last_week)
+        return None, clone_manager._disk_usage(clone_path), None
+
+    def history():
+        commits = list(read_history(clone_path, since=last_week.isoformat()))
+        return commits, sum(len(change.diff) for commit in commits for change in commit.files), None
+
+    rows.append(measure("shallow clone", clone)[1])
+    commits, row = measure("read history", history)
+    rows.append(row)
+
+    # helper configures the model at import, so the fake endpoint has to be set first
+    server = FakeGeminiServer(latency=latency).start()
+    os.environ["GEMINI_API_ENDPOINT"] = server.endpoint
+    import helper
+    reader = batch_reader(clone_path)
+
+    def window(mode):
+        content = helper.commit_diff(reader, commits, mode=mode)
+        return content, len(content.encode('utf-8')), content
+
+    rows.append(measure("commit window (snapshot)", lambda: window("snapshot"))[1])
+    content, row = measure("commit window (diff)", lambda: window("diff"))
+    rows.append(row)
+
+    response_cache.LLM_CACHE_DIR = os.path.join(scratch, "llm_cache")
+    prompt = helper.report_prompt_head + f"\n```\n{content}\n```\n"
+
+    def report():
+        return helper.generate_report(prompt), 0, prompt
+
+    rows.append(measure("generate report", report)[1])
+    rows.append(measure("generate report (cached)", report)[1])
+
+    # The map step of a repository too large for one prompt, with the files split into eight chunks
+    llm = get_model("gemini-1.5-flash", {"temperature": 0.5})
+
+    def map_step():
+        notes = map_chunks(llm, (ingestion.read_repo_parts(repo_path, entries=entries[index::8]) for index in range(8)))
+        if len(notes) != 8:
+            raise RuntimeError(f"map_chunks returned {len(notes)} notes for 8 chunks")
+        return notes, None, None
+
+    rows.append(measure("map chunks", map_step)[1])
+    server.shutdown()
+    return rows
+
+
+# Stages that got slower or bigger than in the baseline by more than tolerance
+def regressions(rows, baseline_rows, tolerance):
+    baseline = {row["stage"]: row for row in baseline_rows}
+    found = []
+    for row in rows:
+        before = baseline.get(row["stage"])
+        if before is None:
+            continue
+        for metric in ("wall_seconds", "peak_bytes"):
+            # Ignore noise on stages too small to measure reliably
+            floor = 0.05 if metric == "wall_seconds" else 1 << 20
+            if row[metric] > max(before[metric], floor) * (1 + tolerance):
+                found.append(f"{row['stage']}: {metric} {before[metric]} -> {row[metric]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion, prompt building and report generation benchmarks")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-size", type=int, default=2048)
+    parser.add_argument("--binaries", type=int, default=50)
+    parser.add_argument("--commits", type=int, default=30)
+    parser.add_argument("--files-per-commit", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay of every fake Gemini call")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="benchmark_suite_")
+    try:
+        repo_path = os.path.join(scratch, "repo")
+        print(f"Creating a synthetic repository with {args.files} files and {args.commits} commits...")
+        make_synthetic_repo(repo_path, args.files, args.file_size, args.binaries, args.commits, args.files_per_commit)
+        rows = run_suite(repo_path, scratch, args.latency_ms / 1000)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as results_file:
+            json.dump({"args": vars(args), "stages": rows}, results_file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as baseline_file:
+            found = regressions(rows, json.load(baseline_file)["stages"], args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import os
+import time
+import datetime
+import threading
+import streamlit as st
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import caching
+from async_llm import call_limited
+from gemini_client import _chunk_text, get_model
+from code_search import SearchIndex
+from response_cache import usage_dict
+from token_estimator import estimate_prompt_tokens
+from tracing import count, span
+
+# Follow-up questions about a repository that was already ingested. The repository goes into a
+# Gemini cached content once per commit, shared by every session of the server process, and each
+# question sends only itself and the last few turns of the conversation. Repositories smaller than
+# the API's minimum cache size are sent inline with every question instead, and repositories larger
+# than the model's input window (or any, with CHAT_RETRIEVAL=always) get the chunks of code most
+# relevant to each question from a local code_search index.
+# Context caching needs a model version such as gemini-1.5-flash-001, not the -latest alias
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-1.5-flash-001")
+# Seconds a cached context lives without questions; each question extends it
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", 3600))
+# Smallest context the API caches (the fake_gemini.py stand-in caches anything, set 0 to use it)
+CHAT_MIN_CACHE_TOKENS = int(os.getenv("CHAT_MIN_CACHE_TOKENS", 32768))
+# Earlier questions and answers sent along with a new question
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", 4))
+# "auto": retrieval only for repositories that do not fit the input window, "always" or "never"
+CHAT_RETRIEVAL = os.getenv("CHAT_RETRIEVAL", "auto")
+
+CHAT_INSTRUCTION = """You are the Betacraft AI. The complete codebase of a repository follows, each file
+    after a "--- <path> ---" line. Answer the developer's questions about it. Refer to files by path and
+    line number, quote only the code the answer needs, and say so when the codebase does not tell."""
+RETRIEVAL_INSTRUCTION = """You are the Betacraft AI. The parts of a repository's codebase that a search found
+    for the developer's question follow, each after a "--- <path>:<first line>-<last line> ---" line. Answer the
+    question from them, refer to files by path and line number, and say so when they do not tell."""
+
+
+# A repository's files kept on the Gemini side for questions. Creates the cached content on first
+# use and again when it expires; falls back to sending the files inline when caching is not possible.
+class RepoContext:
+    def __init__(self, parts, generation_config, model_name=CHAT_MODEL, ttl=CHAT_CACHE_TTL):
+        self.contents = [{"role": "user", "parts": [CHAT_INSTRUCTION, *parts]}]
+        self.generation_config = generation_config
+        self.model_name = model_name
+        self.ttl = ttl
+        self.tokens = estimate_prompt_tokens(self.contents[0]["parts"], model_name)
+        self.lock = threading.Lock()
+        self.cache = None
+        # Why the cached content could not be created; the files are sent inline from then on
+        self.cache_error = None
+        self.touched = 0
+
+    @property
+    def cached(self):
+        return self.cache is not None
+
+    def _create_cache(self):
+        # get_model configures the API client the cached content is created with
+        get_model(self.model_name, self.generation_config)
+        try:
+            self.cache = caching.CachedContent.create(
+                model=self.model_name, contents=self.contents, ttl=datetime.timedelta(seconds=self.ttl),
+            )
+            print(f"Cached {self.tokens} tokens of repository context as {self.cache.name}")
+        except Exception as e:
+            print(f"Error caching repository context, sending it with every question: {e}")
+            self.cache = None
+            self.cache_error = str(e)
+        self.touched = time.time()
+
+    @property
+    def mode(self):
+        return "cached" if self.cached else "inline"
+
+    # (model, contents to put before the conversation) for the next question
+    def model(self, query=None):
+        with self.lock:
+            if self.tokens >= CHAT_MIN_CACHE_TOKENS and self.cache_error is None:
+                if self.cache is not None and time.time() - self.touched > self.ttl / 2:
+                    # Extend the lifetime of a context that is still in use
+                    try:
+                        self.cache.update(ttl=datetime.timedelta(seconds=self.ttl))
+                        self.touched = time.time()
+                    except google_exceptions.NotFound:
+                        self.cache = None
+                if self.cache is None:
+                    self._create_cache()
+            if self.cache is None:
+                return get_model(self.model_name, self.generation_config), self.contents
+            return genai.GenerativeModel.from_cached_content(self.cache, generation_config=self.generation_config), []
+
+    # Forget a cached content that expired or was deleted, so the next question creates it again
+    def expired(self):
+        with self.lock:
+            self.cache = None
+
+    def delete(self):
+        with self.lock:
+            if self.cache is not None:
+                try:
+                    self.cache.delete()
+                except Exception as e:
+                    print(f"Error deleting cached context {self.cache.name}: {e}")
+                self.cache = None
+
+
+# Code of a repository looked up in a code_search.SearchIndex for every question; nothing is cached
+# on the Gemini side and each question is sent with its top SEARCH_TOP_K chunks
+class RetrievalContext:
+    mode = "retrieval"
+    cached = False
+
+    def __init__(self, index, generation_config, model_name=CHAT_MODEL):
+        self.index = index
+        self.generation_config = generation_config
+        self.model_name = model_name
+        self.tokens = 0
+
+    def model(self, query=None):
+        with span("retrieve") as retrieve_span:
+            parts = self.index.retrieve(query or "")
+            retrieve_span.add("chunks", len(parts))
+        self.tokens = estimate_prompt_tokens(parts, self.model_name)
+        return get_model(self.model_name, self.generation_config), [{"role": "user", "parts": [RETRIEVAL_INSTRUCTION, *parts]}]
+
+    def expired(self):
+        pass
+
+
+# RetrievalContext over the search index of the repository at local_path, brought up to date first
+def retrieval_context(local_path, generation_config):
+    index = SearchIndex(local_path)
+    index.update()
+    return RetrievalContext(index, generation_config)
+
+
+# Answer a question about the repository in context, streaming the answer to on_text. history is a
+# list of {"role", "parts"} turns that gets the question and answer appended. Returns the answer and
+# its usage dict plus "cached_content_token_count".
+def ask(context, history, question, on_text):
+    with span("chat") as chat_span:
+        turns = history[-2 * CHAT_HISTORY_TURNS:] + [{"role": "user", "parts": [question]}]
+        # The previous question is part of the search so "and where is it called?" still finds "it"
+        query = " ".join(turn["parts"][0] for turn in turns[-3::2])
+        for attempt in range(2):
+            llm, prefix = context.model(query)
+
+            def send():
+                text = ""
+                usage = None
+                for chunk in llm.generate_content(prefix + turns, stream=True):
+                    text += _chunk_text(chunk)
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    on_text(text)
+                return text, usage
+
+            # Within the shared rate limits, the repository context counted in full even when cached
+            tokens = context.tokens + estimate_prompt_tokens([turn["parts"][0] for turn in turns], context.model_name)
+            try:
+                text, usage = call_limited(send, tokens)
+                break
+            except google_exceptions.NotFound:
+                # The cached content expired between the lifetime check and the call
+                if attempt or not context.cached:
+                    raise
+                context.expired()
+        chat_span.set("mode", context.mode)
+        history.append({"role": "user", "parts": [question]})
+        history.append({"role": "model", "parts": [text]})
+        result = usage_dict(usage)
+        result["cached_content_token_count"] = getattr(usage, "cached_content_token_count", 0) or 0
+        count("prompt_tokens", result["prompt_token_count"])
+        count("cached_tokens", result["cached_content_token_count"])
+        count("output_tokens", result["candidates_token_count"])
+        return text, result
+
+
+# Chat about a repository in the page: earlier turns of this browser session, an input for the next
+# question and its streamed answer with token counts and time. key separates conversations.
+def show_chat(context, key):
+    history = st.session_state.setdefault(f"chat_{key}", [])
+    st.subheader("Ask about this repository")
+    if context.mode == "retrieval":
+        st.caption("The repository is larger than the model's input window, each question gets the code a search finds for it.")
+    elif context.tokens < CHAT_MIN_CACHE_TOKENS:
+        st.caption(f"The repository is small ({context.tokens} tokens), it is sent with every question.")
+    for turn in history:
+        with st.chat_message("user" if turn["role"] == "user" else "assistant"):
+            st.markdown(turn["parts"][0])
+    question = st.chat_input("Ask a follow-up question", key=f"chat_input_{key}")
+    if not question:
+        return
+    with st.chat_message("user"):
+        st.markdown(question)
+    with st.chat_message("assistant"):
+        answer = st.empty()
+        start = time.time()
+        try:
+            _, usage = ask(context, history, question, answer.markdown)
+        except Exception as e:
+            st.write(f"Error generating response: {e}")
+            return
+        st.caption(
+            f"Input tokens: {usage['prompt_token_count']} ({usage['cached_content_token_count']} cached), "
+            f"output tokens: {usage['candidates_token_count']}, {time.time() - start:.1f}s"
+        )
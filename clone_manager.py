@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import datetime
+import threading
+import urllib.parse
+from contextlib import contextmanager
+import git
+from tracing import count, traced
+
+# Checkouts made through checkout() and when they were last used, for LRU eviction
+CLONE_INDEX_FILE = os.getenv("CLONE_INDEX_FILE", "./.clone_index.json")
+# Disk quota for all managed checkouts together
+CLONE_CACHE_MAX_BYTES = int(os.getenv("CLONE_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+# Clone modes, picked by what an analysis reads:
+# FULL     - complete history with all blobs
+# BLOBLESS - every commit and tree but only the blobs that are checked out (whole-repo analysis)
+# SHALLOW  - only the commits since a date plus their parents (commit window reports)
+FULL = "full"
+BLOBLESS = "blobless"
+SHALLOW = "shallow"
+
+# File in the git directory of every checkout made here; only those are fetched, reset and evicted
+CHECKOUT_MARKER = "clone_manager"
+
+# Serializes updates of the clone index between the threads of this process; other processes
+# (batch_cli.py workers, the scheduler) are kept out with a lock on CLONE_INDEX_FILE.lock
+_index_lock = threading.Lock()
+
+
+@contextmanager
+def _locked_index():
+    with _index_lock, open(CLONE_INDEX_FILE + ".lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _pin_path(local_path):
+    return os.path.abspath(local_path).rstrip("/") + ".lock"
+
+
+# Keep the checkout at local_path from being evicted while the block runs, by any thread or process.
+# Hold it from before checkout() until the last read of the files.
+@contextmanager
+def pinned(local_path):
+    os.makedirs(os.path.dirname(_pin_path(local_path)), exist_ok=True)
+    with open(_pin_path(local_path), 'a') as pin_file:
+        fcntl.flock(pin_file, fcntl.LOCK_SH)
+        yield
+
+
+def _load_index():
+    try:
+        with open(CLONE_INDEX_FILE, 'r', encoding='utf-8') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(index):
+    tmp_path = f"{CLONE_INDEX_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file)
+    os.replace(tmp_path, CLONE_INDEX_FILE)
+
+
+def _disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+# Bytes of the checked out files, without the .git directory; measured once per clone
+def _worktree_usage(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        if root == path and ".git" in dirs:
+            dirs.remove(".git")
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+# Bytes of the object store as git counts them (loose objects, packs and garbage), without a walk
+def _git_usage(repo):
+    stats = dict(line.split(": ", 1) for line in repo.git.count_objects("-v").splitlines() if ": " in line)
+    return sum(int(stats.get(name, 0)) for name in ("size", "size-pack", "size-garbage")) * 1024
+
+
+def _since_option(since):
+    if isinstance(since, datetime.datetime):
+        return since.isoformat()
+    return since
+
+
+# git refuses a --shallow-since that no commit falls in; the caller then drops the date bound
+def _empty_window(error):
+    return "no commits selected for shallow requests" in str(error.stderr)
+
+
+# A checkout directory name taken from user input. Rejects names that would make the checkout the
+# working directory, its parent or a path elsewhere.
+def checkout_name(name):
+    name = name.strip()
+    if name in ("", ".", "..") or "/" in name or "\\" in name:
+        raise ValueError(f"Invalid repository name: {name!r}")
+    return name
+
+
+# Name for a repository's checkout and outputs, e.g. "org__repo" for https://github.com/org/repo.git,
+# so repositories of the same name in different organisations do not share one
+def repo_key(repo_url):
+    parts = [part for part in repo_url.rstrip("/").removesuffix(".git").replace(":", "/").split("/") if part]
+    return checkout_name("__".join(parts[-2:]))
+
+
+# URL without the user name and token, for comparing remotes and for messages
+def _public_url(url):
+    parts = urllib.parse.urlsplit(url)
+    if not parts.scheme or "@" not in parts.netloc:
+        return url
+    return urllib.parse.urlunsplit(parts._replace(netloc=parts.netloc.rsplit("@", 1)[1]))
+
+
+# The existing checkout at local_path, when checkout() cloned it from repo_url. Anything else there
+# (the app itself, a checkout of another repository) is left alone.
+def _managed_repo(repo_url, local_path):
+    repo = git.Repo(local_path)
+    if not os.path.exists(os.path.join(repo.git_dir, CHECKOUT_MARKER)):
+        raise ValueError(f"{local_path} exists and was not cloned by clone_manager")
+    origin = repo.git.remote("get-url", "origin")
+    if _public_url(origin) != _public_url(repo_url):
+        raise ValueError(f"{local_path} is a checkout of {_public_url(origin)}, not {_public_url(repo_url)}")
+    if origin != repo_url:
+        # Same repository with other credentials, e.g. a renewed token
+        repo.git.remote("set-url", "origin", repo_url)
+    return repo
+
+
+# Clone repo_url into local_path, or bring an existing checkout up to date with an incremental
+# fetch of the remote HEAD. Returns the git.Repo. Raises git.exc.GitCommandError like clone_from,
+# and ValueError when local_path holds something checkout() did not clone from repo_url.
+@traced("checkout")
+def checkout(repo_url, local_path, mode=FULL, since=None):
+    if mode == SHALLOW and since is None:
+        raise ValueError("SHALLOW checkouts need a since date")
+    options = {}
+    if mode == BLOBLESS:
+        options["filter"] = "blob:none"
+    elif mode == SHALLOW:
+        options["shallow_since"] = _since_option(since)
+
+    with pinned(local_path):
+        return _checkout(repo_url, local_path, mode, options)
+
+
+def _checkout(repo_url, local_path, mode, options):
+    cloned = not os.path.exists(local_path)
+    if not cloned:
+        repo = _managed_repo(repo_url, local_path)
+        shallow = os.path.exists(os.path.join(repo.git_dir, "shallow"))
+        # Partial clones keep their filter in the remote config, so a plain fetch stays blobless
+        if shallow and mode == SHALLOW:
+            try:
+                repo.git.fetch("origin", "HEAD", shallow_since=options["shallow_since"])
+            except git.exc.GitCommandError as e:
+                if not _empty_window(e):
+                    raise
+                # Nothing new in the window: fetch up to what the checkout already has
+                repo.git.fetch("origin", "HEAD")
+                shallow = False
+        else:
+            repo.git.fetch("origin", "HEAD")
+        repo.git.reset("--hard", "FETCH_HEAD")
+    else:
+        shallow = mode == SHALLOW
+        try:
+            repo = git.Repo.clone_from(repo_url, local_path, **options)
+        except git.exc.GitCommandError as e:
+            if mode != SHALLOW or not _empty_window(e):
+                raise
+            # A quiet repository: the latest commit is enough to find there is nothing to report
+            shutil.rmtree(local_path, ignore_errors=True)
+            repo = git.Repo.clone_from(repo_url, local_path, depth=1)
+            shallow = False
+        open(os.path.join(repo.git_dir, CHECKOUT_MARKER), 'w').close()
+    if shallow:
+        # Also fetch the parent of the oldest commit so its diff is against the real previous state
+        repo.git.fetch("--deepen=1", "origin", "HEAD")
+
+    # The files are only measured after a clone; an update keeps the size they had then
+    key = os.path.abspath(local_path)
+    worktree_bytes = None if cloned else _load_index().get(key, {}).get("worktree_bytes")
+    if worktree_bytes is None:
+        worktree_bytes = _worktree_usage(local_path)
+    usage = worktree_bytes + _git_usage(repo)
+    count("bytes", usage)
+    with _locked_index():
+        index = _load_index()
+        index[key] = {"last_used": time.time(), "bytes": usage, "worktree_bytes": worktree_bytes}
+        evict(index, keep=key)
+        _save_index(index)
+    return repo
+
+
+# Delete least recently used checkouts until the managed ones fit in CLONE_CACHE_MAX_BYTES.
+# Pinned checkouts are skipped. Run with the index locked.
+def evict(index, keep=None, max_bytes=CLONE_CACHE_MAX_BYTES):
+    total = sum(entry["bytes"] for entry in index.values())
+    for path, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        with open(_pin_path(path), 'a') as pin_file:
+            try:
+                fcntl.flock(pin_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            print(f"Evicting cached checkout {path}")
+            shutil.rmtree(path, ignore_errors=True)
+        total -= entry["bytes"]
+        del index[path]
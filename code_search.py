@@ -0,0 +1,285 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import hashlib
+import threading
+import git
+from ingestion import iter_repo_files, list_repo_files, read_blob_text
+from tracing import count, traced
+
+# Local search over a repository's code, for questions that only need a few places of it. Files are
+# chunked at function and class boundaries and the chunks scored with BM25 over identifier terms;
+# query words that are not terms of the repository match the terms containing them through a
+# trigram index of the vocabulary ("auth" finds "authenticate" and "oauth"). The index is kept per
+# repository in SEARCH_INDEX_DIR and updated incrementally: a file is only chunked again when its
+# blob SHA changes.
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "./.search_index")
+# Chunks returned for a query
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", 8))
+
+# Longest chunk in lines; longer definitions are split into windows of this size
+CHUNK_MAX_LINES = 120
+# Shorter chunks are merged into the one before them
+CHUNK_MIN_LINES = 4
+# Definitions indented deeper than this (methods of nested classes, inner functions) stay in their parent's chunk
+BOUNDARY_MAX_INDENT = 4
+
+# BM25 parameters, and the weight of a term matched through a trigram instead of exactly
+BM25_K1 = 1.2
+BM25_B = 0.75
+TRIGRAM_WEIGHT = 0.5
+# Most terms a query word expands to through the trigram index
+TRIGRAM_EXPANSIONS = 20
+
+# Bumped when chunking or tokenizing changes, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+DEFINITION_PATTERNS = [
+    # def/class/function/fn/func/struct/... name, with the usual modifiers and Go receivers
+    re.compile(r"^(?P<indent>[ \t]*)(?:(?:export|default|pub(?:\([\w:]+\))?|public|private|protected|static|"
+               r"abstract|final|async|override|internal|open|sealed|data)\s+)*"
+               r"(?:def|class|function\*?|func|fn|interface|struct|enum|trait|impl|module|object|record)\s+"
+               r"(?:\([^)]*\)\s*)?(?P<name>[A-Za-z_$][\w$]*)"),
+    # const name = function / arrow function
+    re.compile(r"^(?P<indent>[ \t]*)(?:export\s+)?(?:const|let|var)\s+(?P<name>[A-Za-z_$][\w$]*)\s*=\s*"
+               r"(?:async\s+)?(?:function\b|\([^)]*\)\s*=>|[A-Za-z_$][\w$]*\s*=>)"),
+    # Java/C#/Kotlin style methods: modifiers, a return type and name(
+    re.compile(r"^(?P<indent>[ \t]*)(?:(?:public|private|protected|static|final|abstract|synchronized|"
+               r"override|internal|virtual|async)\s+)+[\w<>\[\],.? ]*?\b(?P<name>[A-Za-z_]\w*)\s*\("),
+]
+MARKDOWN_HEADING = re.compile(r"^(?P<indent>)#{1,4}\s+(?P<name>.+)")
+# Decorators and comments directly above a definition belong to its chunk
+LEADING_LINE = re.compile(r"^\s*(?:@|#(?!!)|//|/\*|\*|--|<!--)")
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+CAMEL_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# Words too common in code to say anything about a chunk
+STOP_WORDS = {
+    "the", "and", "for", "not", "are", "with", "this", "that", "from", "import", "return", "self", "def",
+    "class", "function", "const", "let", "var", "int", "str", "string", "none", "null", "true", "false",
+    "new", "public", "private", "static", "void", "else", "elif", "then", "end", "is", "in", "of", "to",
+    "if", "or", "as", "be", "it", "on", "an", "at", "by", "do", "we", "you", "where", "what", "how", "which",
+    "there", "any", "all", "code", "file", "files", "list", "handled", "does", "use", "used",
+}
+
+_lock = threading.Lock()
+
+
+# Lower-case terms of a text: every identifier plus its snake_case and camelCase parts
+def tokenize(text):
+    terms = []
+    for identifier in IDENTIFIER.findall(text):
+        words = {identifier.lower()}
+        for piece in identifier.split("_"):
+            words.update(part.lower() for part in CAMEL_PART.findall(piece))
+        terms.extend(word for word in words if len(word) > 1 and word not in STOP_WORDS)
+    return terms
+
+
+def _indent(text):
+    return len(text.expandtabs(4))
+
+
+# (start line, name) of each definition that starts a chunk, 1-based
+def _boundaries(path, lines):
+    patterns = [MARKDOWN_HEADING] if path.lower().endswith((".md", ".rst", ".mdx")) else DEFINITION_PATTERNS
+    found = []
+    for number, line in enumerate(lines, 1):
+        for pattern in patterns:
+            match = pattern.match(line)
+            if match and _indent(match.group("indent")) <= BOUNDARY_MAX_INDENT:
+                start = number
+                # Take the decorators and comments above the definition along
+                while start > 1 and (not found or start - 1 > found[-1][0]) and LEADING_LINE.match(lines[start - 2]):
+                    start -= 1
+                found.append((start, match.group("name").strip()))
+                break
+    return found
+
+
+# Chunks of a file as (first line, last line, name), 1-based and inclusive: one per top-level
+# definition or method (markdown: per heading), with long ones split and short ones merged
+def chunk_lines(path, content):
+    lines = content.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    if not lines:
+        return []
+    boundaries = _boundaries(path, lines)
+    if not boundaries or boundaries[0][0] > 1:
+        boundaries.insert(0, (1, None))
+    chunks = []
+    for index, (start, name) in enumerate(boundaries):
+        end = boundaries[index + 1][0] - 1 if index + 1 < len(boundaries) else len(lines)
+        if chunks and end - start + 1 < CHUNK_MIN_LINES and chunks[-1][1] - chunks[-1][0] + 1 < CHUNK_MAX_LINES:
+            chunks[-1] = (chunks[-1][0], end, chunks[-1][2] or name)
+            continue
+        for window in range(start, end + 1, CHUNK_MAX_LINES):
+            chunks.append((window, min(window + CHUNK_MAX_LINES - 1, end), name))
+    return chunks
+
+
+# Chunks of a file with their term frequencies, as stored in the index
+def index_file(path, content):
+    lines = content.split("\n")
+    chunks = []
+    for start, end, name in chunk_lines(path, content):
+        # The path is part of every chunk so "where is auth handled" also finds auth/*.py
+        terms = {}
+        for term in tokenize(path + " " + "\n".join(lines[start - 1:end])):
+            terms[term] = terms.get(term, 0) + 1
+        chunks.append({"start": start, "end": end, "name": name, "terms": terms, "length": sum(terms.values())})
+    return chunks
+
+
+# Search index of one repository. update() brings it in line with the files tracked at HEAD; files
+# read elsewhere (see ingestion.iter_repo_files) can be added with add() and kept with save().
+class SearchIndex:
+    def __init__(self, repo_path, index_dir=SEARCH_INDEX_DIR):
+        self.repo_path = repo_path
+        key = hashlib.sha1(os.path.abspath(repo_path).encode('utf-8')).hexdigest()[:16]
+        self.index_file = os.path.join(index_dir, key + ".json")
+        # {path: {"sha", "chunks"}}, and the chunks of every blob SHA seen
+        self.files = self._load()
+        self.by_sha = {entry["sha"]: entry["chunks"] for entry in self.files.values()}
+        self.lock = threading.Lock()
+        self._postings = None
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        if index.get("version") != INDEX_VERSION:
+            return {}
+        return index["files"]
+
+    # Index a file's content under its blob SHA; chunks of a SHA already indexed (the same file, a
+    # copy or a rename) are reused
+    def add(self, path, blob_sha, content):
+        with self.lock:
+            current = self.files.get(path)
+            if current is not None and current["sha"] == blob_sha:
+                return
+            chunks = self.by_sha.get(blob_sha)
+            if chunks is None:
+                chunks = self.by_sha[blob_sha] = index_file(path, content)
+            self.files[path] = {"sha": blob_sha, "chunks": chunks}
+            self._postings = None
+        count("indexed_files")
+
+    def save(self):
+        with self.lock:
+            index = {"version": INDEX_VERSION, "repo": os.path.abspath(self.repo_path), "files": self.files}
+            with _lock:
+                os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+                tmp_path = f"{self.index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as index_file:
+                    json.dump(index, index_file)
+                os.replace(tmp_path, self.index_file)
+
+    # Index the files tracked at HEAD that changed since the last update and drop deleted ones.
+    # Returns the number of files (re)indexed.
+    @traced("search_index")
+    def update(self):
+        entries = list_repo_files(git.Repo(self.repo_path))
+        tracked = {path: blob_sha for path, blob_sha, _ in entries}
+        with self.lock:
+            deleted = [path for path in self.files if path not in tracked]
+            for path in deleted:
+                del self.files[path]
+                self._postings = None
+        changed = [entry for entry in entries if self.files.get(entry[0], {}).get("sha") != entry[1]]
+        # Only blobs never chunked before are read; add() reuses the chunks of the others
+        for _ in iter_repo_files(self.repo_path, entries=[entry for entry in changed if entry[1] not in self.by_sha], indexer=self):
+            pass
+        for path, blob_sha, _ in changed:
+            if blob_sha in self.by_sha:
+                self.add(path, blob_sha, None)
+        if changed or deleted:
+            self.save()
+        return len(changed)
+
+    # In-memory inverted index built on first search: chunk list, {term: [(chunk, tf)]}, trigrams
+    def _build(self):
+        chunks = []
+        postings = {}
+        for path in sorted(self.files):
+            entry = self.files[path]
+            for chunk in entry["chunks"]:
+                chunk_id = len(chunks)
+                chunks.append((path, entry["sha"], chunk["start"], chunk["end"], chunk["name"], chunk["length"]))
+                for term, frequency in chunk["terms"].items():
+                    postings.setdefault(term, []).append((chunk_id, frequency))
+        trigrams = {}
+        for term in postings:
+            for index in range(len(term) - 2):
+                trigrams.setdefault(term[index:index + 3], set()).add(term)
+        average = sum(chunk[5] for chunk in chunks) / len(chunks) if chunks else 0
+        return chunks, postings, trigrams, average
+
+    # {term: weight} for the words of a query: the word itself, and through the trigram index the
+    # most common repository terms that contain it
+    def _query_terms(self, query, postings, trigrams):
+        weights = {}
+        for word in set(tokenize(query)):
+            if word in postings:
+                weights[word] = max(weights.get(word, 0), 1.0)
+            if len(word) < 3:
+                continue
+            candidates = None
+            for index in range(len(word) - 2):
+                terms = trigrams.get(word[index:index + 3], set())
+                candidates = terms if candidates is None else candidates & terms
+                if not candidates:
+                    break
+            expansions = sorted((term for term in candidates or () if word in term and term != word),
+                                key=lambda term: len(postings[term]), reverse=True)
+            for term in expansions[:TRIGRAM_EXPANSIONS]:
+                weights[term] = max(weights.get(term, 0), TRIGRAM_WEIGHT)
+        return weights
+
+    # Top k chunks for a query as dicts with path, sha, start, end, name and score, best first
+    def search(self, query, k=SEARCH_TOP_K):
+        with self.lock:
+            if self._postings is None:
+                self._postings = self._build()
+            chunks, postings, trigrams, average = self._postings
+        scores = {}
+        for term, weight in self._query_terms(query, postings, trigrams).items():
+            matches = postings[term]
+            idf = math.log(1 + (len(chunks) - len(matches) + 0.5) / (len(matches) + 0.5))
+            for chunk_id, frequency in matches:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * chunks[chunk_id][5] / average)
+                score = weight * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                scores[chunk_id] = scores.get(chunk_id, 0) + score
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [dict(zip(("path", "sha", "start", "end", "name"), chunks[chunk_id][:5]), score=scores[chunk_id])
+                for chunk_id in best]
+
+    # Prompt text for a query: the top k chunks, each after a "--- path:start-end (name) ---" line
+    def retrieve(self, query, k=SEARCH_TOP_K):
+        parts = []
+        for result in self.search(query, k):
+            content = read_blob_text(self.repo_path, result["path"], result["sha"]) or ""
+            text = "\n".join(content.split("\n")[result["start"] - 1:result["end"]])
+            name = f" ({result['name']})" if result["name"] else ""
+            parts.append(f"\n\n--- {result['path']}:{result['start']}-{result['end']}{name} ---\n\n{text}\n")
+        return parts
+
+
+# Usage: python code_search.py <repository path> <query> [k]
+if __name__ == "__main__":
+    index = SearchIndex(sys.argv[1])
+    start = time.perf_counter()
+    print(f"Indexed {index.update()} changed files in {time.perf_counter() - start:.2f}s")
+    index.search("")
+    start = time.perf_counter()
+    results = index.search(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else SEARCH_TOP_K)
+    print(f"Query took {(time.perf_counter() - start) * 1000:.1f} ms")
+    for result in results:
+        print(f"{result['score']:8.2f}  {result['path']}:{result['start']}-{result['end']}  {result['name'] or ''}")
@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import heapq
+import difflib
+import hashlib
+from token_estimator import estimate_tokens
+from tracing import count
+
+# Optional compaction of repository files before they go into a prompt: license headers, trailing
+# whitespace and runs of blank lines are stripped, JSON is minified, and files that are identical
+# or nearly identical to one already in the same prompt are folded into a reference to it (plus
+# the lines that differ). Turned on with COMPACT_PROMPTS=1.
+COMPACT_PROMPTS = os.getenv("COMPACT_PROMPTS", "0") == "1"
+# Also drop every full-line comment, not only license headers
+COMPACT_STRIP_COMMENTS = os.getenv("COMPACT_STRIP_COMMENTS", "0") == "1"
+# Estimated share of lines two files have in common to be folded together
+COMPACT_DUP_THRESHOLD = float(os.getenv("COMPACT_DUP_THRESHOLD", 0.85))
+# Files larger than this are only folded when they are exact duplicates
+COMPACT_FOLD_MAX_BYTES = int(os.getenv("COMPACT_FOLD_MAX_BYTES", 256 * 1024))
+
+# Smaller files are never folded, a reference would not be much shorter
+FOLD_MIN_BYTES = 200
+FOLD_MIN_LINES = 8
+# Hashes kept in a file's MinHash sketch (bottom-k), and sketch hashes two files must share
+# before their similarity is estimated
+SKETCH_SIZE = 64
+CANDIDATE_MIN_SHARED = 8
+
+LINE_COMMENT = {}
+for _extension in (".py", ".sh", ".bash", ".zsh", ".rb", ".pl", ".r", ".yaml", ".yml", ".toml", ".cfg",
+                   ".ini", ".conf", ".ex", ".exs", ".cmake", ".mk", ".tf", ".dockerfile", ".ps1", ".jl"):
+    LINE_COMMENT[_extension] = "#"
+for _extension in (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".java", ".kt", ".kts", ".scala", ".c",
+                   ".h", ".cc", ".cpp", ".hpp", ".cs", ".swift", ".go", ".rs", ".php", ".m", ".dart",
+                   ".groovy", ".gradle", ".scss", ".less", ".proto"):
+    LINE_COMMENT[_extension] = "//"
+for _extension in (".sql", ".lua", ".hs", ".elm"):
+    LINE_COMMENT[_extension] = "--"
+LINE_COMMENT_NAMES = {"dockerfile": "#", "makefile": "#", "gemfile": "#", "rakefile": "#", "procfile": "#"}
+
+BLOCK_COMMENT = {}
+for _extension in (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".java", ".kt", ".kts", ".scala", ".c",
+                   ".h", ".cc", ".cpp", ".hpp", ".cs", ".swift", ".go", ".rs", ".php", ".m", ".dart",
+                   ".groovy", ".gradle", ".css", ".scss", ".less", ".proto", ".sql"):
+    BLOCK_COMMENT[_extension] = ("/*", "*/")
+for _extension in (".html", ".htm", ".xml", ".vue", ".svelte", ".md", ".xhtml"):
+    BLOCK_COMMENT[_extension] = ("<!--", "-->")
+
+LICENSE_WORDS = re.compile(r"copyright|licen[cs]e|spdx-license-identifier|all rights reserved|\(c\) \d{4}", re.IGNORECASE)
+
+
+def _comment_syntax(path):
+    name = os.path.basename(path).lower()
+    extension = os.path.splitext(name)[1]
+    return LINE_COMMENT.get(extension) or LINE_COMMENT_NAMES.get(name), BLOCK_COMMENT.get(extension)
+
+
+# Index of the first line after the comments and blank lines at the top of a file, keeping a
+# shebang or encoding line out of the block. Returns (first kept line, end of the header block).
+def _header_block(lines, line_comment, block_comment):
+    start = 0
+    if lines and (lines[0].startswith("#!") or "coding" in lines[0] and lines[0].startswith("#")):
+        start = 1
+    end = start
+    in_block = False
+    while end < len(lines):
+        stripped = lines[end].strip()
+        if in_block:
+            in_block = block_comment[1] not in stripped
+        elif block_comment and stripped.startswith(block_comment[0]):
+            in_block = block_comment[1] not in stripped[len(block_comment[0]):]
+        elif not (stripped == "" or line_comment and stripped.startswith(line_comment)):
+            break
+        end += 1
+    return start, end
+
+
+# Lines without full-line comments; comments after code are kept since telling them apart from
+# comment markers inside strings needs a real parser
+def _strip_comment_lines(lines, line_comment, block_comment):
+    kept = []
+    in_block = False
+    for line in lines:
+        stripped = line.strip()
+        if in_block:
+            in_block = block_comment[1] not in stripped
+            continue
+        if block_comment and stripped.startswith(block_comment[0]):
+            rest = stripped[len(block_comment[0]):]
+            if block_comment[1] not in rest:
+                in_block = True
+                continue
+            if rest.endswith(block_comment[1]):
+                continue
+        if line_comment and stripped.startswith(line_comment) and not stripped.startswith("#!"):
+            continue
+        kept.append(line)
+    return kept
+
+
+# Compacted text of one file and whether a license header was dropped from it
+def compact_text(path, content, strip_comments=COMPACT_STRIP_COMMENTS):
+    if path.lower().endswith(".json"):
+        try:
+            return json.dumps(json.loads(content), ensure_ascii=False, separators=(",", ":")), False
+        except ValueError:
+            pass
+    line_comment, block_comment = _comment_syntax(path)
+    lines = content.split("\n")
+    header_stripped = False
+    if line_comment or block_comment:
+        start, end = _header_block(lines, line_comment, block_comment)
+        if LICENSE_WORDS.search("\n".join(lines[start:end])):
+            lines = lines[:start] + lines[end:]
+            header_stripped = True
+        if strip_comments:
+            lines = _strip_comment_lines(lines, line_comment, block_comment)
+
+    compacted = []
+    blank = False
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            blank = True
+            continue
+        if blank and compacted:
+            compacted.append("")
+        blank = False
+        compacted.append(line)
+    return "\n".join(compacted) + "\n", header_stripped
+
+
+# Stable 64-bit hash of a line; hash() of a str changes between processes
+def _line_hash(line):
+    return int.from_bytes(hashlib.blake2b(line.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+# Bottom-k MinHash sketch of a file's distinct non-blank lines, whitespace-normalized
+def _sketch(lines):
+    features = set(_line_hash(" ".join(line.split())) for line in lines if line.strip())
+    return heapq.nsmallest(SKETCH_SIZE, features), len(features)
+
+
+# Estimated Jaccard similarity of the line sets behind two sketches
+def _similarity(sketch, other):
+    union = heapq.nsmallest(SKETCH_SIZE, set(sketch) | set(other))
+    both = set(sketch) & set(other)
+    return sum(1 for value in union if value in both) / len(union) if union else 0.0
+
+
+# Compacts the files of each prompt and keeps totals across prompts for the savings report
+class Compactor:
+    def __init__(self, strip_comments=COMPACT_STRIP_COMMENTS, threshold=COMPACT_DUP_THRESHOLD,
+                 fold_max_bytes=COMPACT_FOLD_MAX_BYTES):
+        self.strip_comments = strip_comments
+        self.threshold = threshold
+        self.fold_max_bytes = fold_max_bytes
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.headers_stripped = 0
+        # {kept file path: [paths folded into it]}
+        self.folded = {}
+
+    # Compact (file_path, content) pairs of one prompt, yielding them in the same order. A file that
+    # duplicates an earlier one of the same call is replaced by a reference to it and its diff.
+    def files(self, files):
+        exact = {}
+        # Representatives of this prompt: [(path, text, lines, sketch)] and {sketch hash: [index]}
+        kept = []
+        index = {}
+        for file_path, content in files:
+            text, header_stripped = compact_text(file_path, content, self.strip_comments)
+            self.headers_stripped += header_stripped
+            folded = None
+            if len(text) >= FOLD_MIN_BYTES:
+                digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                if digest in exact:
+                    folded = f"(identical to {exact[digest]})\n"
+                    self._fold(exact[digest], file_path)
+                else:
+                    exact[digest] = file_path
+                    if len(text) <= self.fold_max_bytes:
+                        folded = self._near_duplicate(file_path, text, kept, index)
+            result = folded or text
+            before = estimate_tokens(content)
+            after = estimate_tokens(result)
+            self.tokens_before += before
+            self.tokens_after += after
+            count("tokens_saved", before - after)
+            yield file_path, result
+
+    def _fold(self, kept_path, file_path):
+        self.folded.setdefault(kept_path, []).append(file_path)
+
+    # Reference to a near-duplicate among the kept files, or None after adding the file to them
+    def _near_duplicate(self, file_path, text, kept, index):
+        lines = text.split("\n")
+        sketch, distinct = _sketch(lines)
+        if distinct < FOLD_MIN_LINES:
+            return None
+        shared = {}
+        for value in sketch:
+            for candidate in index.get(value, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        for candidate in sorted(shared, key=shared.get, reverse=True):
+            if shared[candidate] < CANDIDATE_MIN_SHARED:
+                break
+            kept_path, kept_text, kept_lines, kept_sketch = kept[candidate]
+            similarity = _similarity(sketch, kept_sketch)
+            if similarity < self.threshold:
+                continue
+            diff = [line for line in difflib.unified_diff(kept_lines, lines, n=0, lineterm="")
+                    if not line.startswith(("---", "+++"))]
+            note = f"(near-duplicate of {kept_path}, {similarity:.0%} similar; differences:)\n" + "\n".join(diff) + "\n"
+            # Not worth it when the differences take about as much room as the file
+            if len(note) < len(text) / 2:
+                self._fold(kept_path, file_path)
+                return note
+        for value in sketch:
+            index.setdefault(value, []).append(len(kept))
+        kept.append((file_path, text, lines, sketch))
+        return None
+
+    @property
+    def tokens_saved(self):
+        return self.tokens_before - self.tokens_after
+
+    # One line summary, e.g. "Compaction saved about 120000 tokens (35%): 40 license headers
+    # stripped, 25 duplicate files folded into 6"
+    def summary(self):
+        share = self.tokens_saved / self.tokens_before if self.tokens_before else 0
+        details = [f"{self.headers_stripped} license headers stripped"]
+        if self.folded:
+            folded = sum(len(paths) for paths in self.folded.values())
+            details.append(f"{folded} duplicate files folded into {len(self.folded)}")
+        return f"Compaction saved about {self.tokens_saved} tokens ({share:.0%}): " + ", ".join(details)
+
+
+# A Compactor when COMPACT_PROMPTS is on, otherwise None (files go into prompts as they are)
+def default_compactor():
+    return Compactor() if COMPACT_PROMPTS else None
@@ -0,0 +1,218 @@
+import json
+import time
+import uuid
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Gemini REST API (generateContent, streamGenerateContent, countTokens and
+# cachedContents) for benchmarks and offline runs. Point the app at it with
+# GEMINI_API_ENDPOINT=http://127.0.0.1:<port> (see gemini_client.get_model), or run
+# `python fake_gemini.py [port]`. Every call returns the same canned report after `latency` seconds,
+# streamed in a few chunks, with usage metadata estimated from the request size; a call on a
+# cached content counts its tokens as cached the way the real API does.
+REPORT = """## Repository Codebase Analysis Report
+
+**1. Repository Metadata:**
+
+* **Commits:** Synthetic history.
+* **Contributors:** One benchmark author.
+
+**2. Code Quality & Best Practices Evaluation:**
+
+* **Code Quality:** Generated by the fake Gemini endpoint.
+
+**3. Insights:**
+
+- No real analysis was performed.
+
+**4. Recommendations:**
+
+* **Refactoring & Optimization:** None.
+"""
+
+
+def _usage(request_chars, text, cached_tokens=0):
+    prompt_tokens = request_chars // 4 + 1 + cached_tokens
+    output_tokens = len(text) // 4 + 1
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + output_tokens,
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return usage
+
+
+def _request_chars(request):
+    contents = list(request.get("contents", []))
+    if request.get("systemInstruction"):
+        contents.append(request["systemInstruction"])
+    return sum(len(part.get("text", "")) for content in contents for part in content.get("parts", []))
+
+
+def _timestamp(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _response(text, usage=None, finish=True):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    response = {"candidates": [candidate]}
+    if usage:
+        response["usageMetadata"] = usage
+    return response
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    def _read_request(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.request_bytes += len(body)
+        return json.loads(body or b"{}")
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_not_found(self, name):
+        self._send_json({"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}}, 404)
+
+    # cachedContents/<id> of the request path, or None for the collection
+    def _cache_name(self):
+        path = self.path.split("?")[0]
+        return path[path.index("cachedContents"):] if "cachedContents/" in path else None
+
+    # The stored cached content, or None after answering 404 for a missing or expired one
+    def _find_cache(self, name):
+        with self.server.lock:
+            cache = self.server.caches.get(name)
+            if cache is not None and cache["expire"] < time.time():
+                del self.server.caches[name]
+                cache = None
+        if cache is None:
+            self._send_not_found(name)
+        return cache
+
+    def _cache_resource(self, cache):
+        return {
+            "name": cache["name"], "model": cache["model"],
+            "createTime": _timestamp(cache["created"]), "updateTime": _timestamp(cache["updated"]),
+            "expireTime": _timestamp(cache["expire"]),
+            "usageMetadata": {"totalTokenCount": cache["tokens"]},
+        }
+
+    def do_GET(self):
+        name = self._cache_name()
+        if name is None:
+            self._send_not_found(self.path)
+            return
+        cache = self._find_cache(name)
+        if cache is not None:
+            self._send_json(self._cache_resource(cache))
+
+    def do_PATCH(self):
+        request = self._read_request()
+        cache = self._find_cache(self._cache_name())
+        if cache is None:
+            return
+        now = time.time()
+        with self.server.lock:
+            cache["expire"] = now + float(request.get("ttl", "3600s").rstrip("s"))
+            cache["updated"] = now
+        self._send_json(self._cache_resource(cache))
+
+    def do_DELETE(self):
+        name = self._cache_name()
+        if self._find_cache(name) is not None:
+            with self.server.lock:
+                self.server.caches.pop(name, None)
+            self._send_json({})
+
+    def do_POST(self):
+        request = self._read_request()
+        server = self.server
+        if self.path.split("?")[0].endswith("/cachedContents"):
+            now = time.time()
+            cache = {
+                "name": f"cachedContents/{uuid.uuid4().hex[:12]}", "model": request.get("model", ""),
+                "tokens": _request_chars(request) // 4 + 1, "created": now, "updated": now,
+                "expire": now + float(request.get("ttl", "3600s").rstrip("s")),
+            }
+            with server.lock:
+                server.caches[cache["name"]] = cache
+            self._send_json(self._cache_resource(cache))
+            return
+
+        cached_tokens = 0
+        if request.get("cachedContent"):
+            cache = self._find_cache(request["cachedContent"])
+            if cache is None:
+                return
+            cached_tokens = cache["tokens"]
+        time.sleep(server.latency)
+        usage = _usage(_request_chars(request), server.report, cached_tokens)
+
+        if ":streamGenerateContent" in self.path:
+            # Server-sent events for ?alt=sse, otherwise a JSON array streamed element by element,
+            # which is what the Python client's REST transport asks for
+            sse = "alt=sse" in self.path
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+            self.end_headers()
+            sections = server.report.split("\n\n")
+            for index, section in enumerate(sections):
+                last = index == len(sections) - 1
+                text = section + ("" if last else "\n\n")
+                event = json.dumps(_response(text, usage if last else None, finish=last))
+                if sse:
+                    data = f"data: {event}\r\n\r\n"
+                else:
+                    data = ("[" if index == 0 else ",\r\n") + event + ("]" if last else "")
+                self.wfile.write(data.encode('utf-8'))
+                self.wfile.flush()
+            return
+        if ":countTokens" in self.path:
+            self._send_json({"totalTokens": usage["promptTokenCount"]})
+        else:
+            self._send_json(_response(server.report, usage))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, report=REPORT):
+        super().__init__(("127.0.0.1", port), FakeGeminiHandler)
+        self.latency = latency
+        self.report = report
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_bytes = 0
+        # {"cachedContents/<id>": {"name", "model", "tokens", "created", "updated", "expire"}}
+        self.caches = {}
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    # Serve on a daemon thread and return self
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-gemini", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    import sys
+    server = FakeGeminiServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8089)
+    print(f"Fake Gemini endpoint on {server.endpoint}")
+    server.serve_forever()
@@ -0,0 +1,109 @@
+import os
+import re
+import streamlit as st
+import google.generativeai as genai
+from dotenv import load_dotenv
+import response_cache
+from async_llm import call_limited
+from response_cache import CachedResponse, usage_dict
+from token_estimator import estimate_prompt_tokens
+
+# Gemini client for a model and generation_config, created once per server process. Streamlit reruns
+# the scripts on every interaction; reruns and new sessions get this same configured client.
+# GEMINI_API_ENDPOINT sends the calls over REST to another endpoint, e.g. fake_gemini.py.
+@st.cache_resource(show_spinner=False)
+def get_model(model_name, generation_config):
+    load_dotenv()
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY") or "local", transport="rest",
+                        client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+
+
+# Reports generated by this server process, keyed by (repository path, HEAD sha, model name),
+# so a commit that was already analysed is shown again without reading the repository
+@st.cache_resource(show_spinner=False)
+def report_store():
+    return {}
+
+
+# A report section starts at a markdown heading or a bold numbered heading such as "**2. Code Quality"
+SECTION_START = re.compile(r"(?m)^(?=[ \t]*(?:#{1,4} |\*\*\d+\.))")
+
+
+# Shows a streamed report in a Streamlit container one section at a time: every section gets its
+# own element, so finished sections are drawn once and only the one still arriving is redrawn
+class SectionStream:
+    def __init__(self, container):
+        self.container = container
+        self.placeholders = []
+
+    def __call__(self, text):
+        sections = [section for section in SECTION_START.split(text) if section.strip()]
+        first_changed = max(len(self.placeholders) - 1, 0)
+        while len(self.placeholders) < len(sections):
+            self.placeholders.append(self.container.empty())
+        for index in range(first_changed, len(sections)):
+            self.placeholders[index].markdown(sections[index])
+
+
+def _chunk_text(chunk):
+    # Chunks that only carry a finish reason or usage metadata have no text parts
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+# Name of the reason a streamed response stopped (STOP, MAX_TOKENS, SAFETY, ...), or None for the
+# chunks before the last one
+def _finish_reason(chunk):
+    candidates = getattr(chunk, "candidates", None)
+    reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    reason = getattr(reason, "name", reason)
+    return reason if reason and reason != "FINISH_REASON_UNSPECIFIED" else None
+
+
+# llm.generate_content(prompt) through the cache, within the shared rate limits of async_llm
+def cached_generate(llm, prompt):
+    key = response_cache.cache_key(llm, prompt)
+    response = response_cache.load(key)
+    if response is None:
+        response = call_limited(lambda: llm.generate_content(prompt), estimate_prompt_tokens(prompt, llm.model_name))
+        response_cache.store(key, response)
+    return response
+
+
+# Generate with stream=True, calling on_text with the text received so far after every chunk.
+# Returns a response with the full text, the usage metadata and the finish reason of the final chunk,
+# and goes through response_cache like cached_generate; a cached report is shown at once. Empty
+# responses and ones stopped early (e.g. for SAFETY) are returned but not cached.
+def stream_generate(llm, prompt, on_text):
+    key = response_cache.cache_key(llm, prompt)
+    response = response_cache.load(key)
+    if response is not None:
+        on_text(response.text)
+        return response
+
+    def send():
+        text = ""
+        usage = None
+        finish_reason = None
+        for chunk in llm.generate_content(prompt, stream=True):
+            text += _chunk_text(chunk)
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            finish_reason = _finish_reason(chunk) or finish_reason
+            on_text(text)
+        return text, usage, finish_reason
+
+    # Within the same quota as the concurrent calls of async_llm, started over after a 429
+    text, usage, finish_reason = call_limited(send, estimate_prompt_tokens(prompt, llm.model_name))
+    response = CachedResponse(text, usage_dict(usage), finish_reason)
+    if response.complete:
+        response_cache.store(key, response)
+    else:
+        print(f"Incomplete response ({finish_reason}, {len(text)} characters), not cached")
+    return response
@@ -3,35 +3,17 @@ import time
 import shutil
 import streamlit as st
 import git
-from dotenv import load_dotenv
-import google.generativeai as genai
-
-# Load environment variables
-load_dotenv()
-
-# Configure Google API key for Generative AI model
-GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GOOGLE_API_KEY)
-
-# Function to read files from a repository and append their content to an output file
-def read_and_append_files(repo_path, output_file):
-    with open(output_file, 'w') as outfile:
-        repo = git.Repo(repo_path)
-        commits = len(list(repo.iter_commits()))
-        outfile.write(f"Total commits: {commits}\n\n")
-        for root, dirs, files in os.walk(repo_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as infile:
-                        content = infile.read()
-                        outfile.write(f"\n\n--- {file_path} ---\n\n")
-                        outfile.write(content)
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
-
-
-# Step 1: Load the model
+from gemini_client import SectionStream, get_model, report_store, stream_generate
+from token_estimator import calibrate, estimate_prompt_tokens
+from clone_manager import BLOBLESS, checkout, checkout_name
+from ingestion import format_skip_report, read_repo_parts
+from compaction import default_compactor
+from chat import CHAT_MODEL, CHAT_RETRIEVAL, RepoContext, retrieval_context, show_chat
+from prompt_packer import prompt_budget
+from tracing import start_metrics_server
+from helper import report_scheduler
+
+# Step 1: Load the model (configured once per server process, see gemini_client.get_model)
 print("Loading Gemini 1.5 flash model...")
 generation_config = {
   "temperature": 1,
@@ -42,12 +24,35 @@ generation_config = {
   "response_mime_type": "text/plain",
 }
 
-llm = genai.GenerativeModel(
-  model_name="gemini-1.5-flash",
-  generation_config=generation_config,
-)
+llm = get_model("gemini-1.5-flash", generation_config)
 
 
+# Prompt parts of one commit of a repository, kept across reruns and sessions;
+# head_sha is only part of the cache key. Also returns the compaction summary when it is on.
+@st.cache_resource(show_spinner=False, max_entries=16)
+def ingest_repository(local_path, head_sha, spill_file):
+    skip_report = {}
+    compactor = default_compactor()
+    parts = read_repo_parts(local_path, spill_file, report=skip_report, compactor=compactor)
+    return parts, skip_report, compactor.summary() if compactor is not None else None
+
+
+# Context for follow-up questions about the same commit, shared by every session (see chat.py)
+@st.cache_resource(show_spinner=False, max_entries=8)
+def chat_context(local_path, head_sha, spill_file):
+    if CHAT_RETRIEVAL == "always":
+        return retrieval_context(local_path, generation_config)
+    parts, _, _ = ingest_repository(local_path, head_sha, spill_file)
+    context = RepoContext(parts, generation_config)
+    # Too large to cache: search the repository for every question instead
+    if CHAT_RETRIEVAL == "auto" and context.tokens > prompt_budget(CHAT_MODEL):
+        return retrieval_context(local_path, generation_config)
+    return context
+
+
+start_metrics_server()
+# Start the shared report scheduler with the server, so stored schedules run after a restart
+report_scheduler()
 
 # Display title
 st.title("Gemini Code Analyst")
@@ -59,33 +64,40 @@ repo_url = st.text_input("Enter GitHub repository URL: ")
 # Button to trigger analysis
 if st.button("Submit"):
     # st.session_state.chat_history.append("You: " + repo_url)
-    local_path = './' + repo_url.split('/')[-1].replace('.git', '')
+    try:
+        local_path = './' + checkout_name(repo_url.rstrip('/').split('/')[-1].replace('.git', ''))
+    except ValueError as e:
+        st.write(f"Error: {e}")
+        st.stop()
     output_file = local_path + '_output.txt'
 
-    # Step 2: Clone the repository if not already cloned
-    if not os.path.exists(local_path):
+    # Step 2: Clone the repository (blobless: history plus the checked out files only),
+    # or fetch what changed if it is already cloned
+    if os.path.exists(local_path):
+        st.write("Repository already exists, fetching changes...")
+    else:
         print("Cloning Repository...")
         st.write("Cloning repository...")
-        try:
-            git.Repo.clone_from(repo_url, local_path)
-        except Exception as e:
-            st.write(f"Error cloning repository: {e}")
-    else:
-        st.write("Repository already exists")
+    try:
+        checkout(repo_url, local_path, mode=BLOBLESS)
+    except Exception as e:
+        st.write(f"Error cloning repository: {e}")
 
-    # Process the files in the repository
+    # Process the files in the repository, spilling to the output file for very large repos
     print("Processing files...")
-    read_and_append_files(local_path, output_file)
-
     st.write("Reading files...")
-    print("Reading files...")
+    spill_file = output_file if os.getenv("INGEST_SPILL") else None
     try:
-        with open(output_file, 'r') as file:
-            text = file.read()
+        head_sha = git.Repo(local_path).head.commit.hexsha
+        parts, skip_report, compaction = ingest_repository(local_path, head_sha, spill_file)
         st.write("Files read successfully.")
     except Exception as e:
-        st.write(f"Error reading output file: {e}\n\n")
-        text = ""
+        st.write(f"Error reading files: {e}\n\n")
+        head_sha, parts, skip_report, compaction = None, [], {}, None
+    if skip_report:
+        st.write(format_skip_report(skip_report))
+    if compaction:
+        st.write(compaction)
 
     # Output Format of LLM
     output_format = """
@@ -127,8 +139,8 @@ if st.button("Submit"):
     * **Collaboration:**  Consider inviting more contributors or seeking feedback from the Rails community to foster diverse perspectives and enhance code quality.
     
     """
-    # Define prompt for Generative AI model
-    prompt = f"""You are a Software Engineer. You have to read the following code of a github repository in triple backticks and 
+    # Define prompt for Generative AI model; the repository parts go between the head and tail
+    prompt_head = f"""You are a Software Engineer. You have to read the following code of a github repository in triple backticks and 
     based on the code you have to perform the following actions if the context is empty then return "Context Empty"
     1. Metadata collection on commits, branches, and contributors to understand repository activity.
     2. Answer the following questions \n
@@ -150,37 +162,43 @@ if st.button("Submit"):
     you have to get the code which are not following the above actions it in the Technical Reports.
     
     Replace with actual data for <>.
-    Code:  ```{text}```
+    Code:  ```"""
+    prompt_tail = """```
     """ 
+    prompt = [prompt_head, *parts, prompt_tail]
     
     # Generate response from Generative AI model
     print("Generating response...")
     st.write("Waiting for Gemini response...")
-    input_tokens = llm.count_tokens(prompt)
-    st.write(f"Input tokens: {input_tokens.total_tokens}")
+    # Estimated locally; the exact counts come back with the response
+    st.write(f"Estimated input tokens: {estimate_prompt_tokens(prompt, llm.model_name)}")
     
+    reports = report_store()
+    report_key = (os.path.abspath(local_path), head_sha, llm.model_name)
     try:
-        processed_data = ""
-        response = llm.generate_content(prompt)
-        response.resolve()
-        # time.sleep(10)
-        output_tokens = llm.count_tokens(response.text)
-        st.write(f"Output tokens: {output_tokens.total_tokens}")
+        response = reports.get(report_key) if head_sha else None
+        if response is not None:
+            st.write("This commit was already analysed, showing the earlier report.")
+            SectionStream(st.container())(response.text)
+        else:
+            # Stream the report into the page section by section as it is generated
+            response = stream_generate(llm, prompt, SectionStream(st.container()))
+            calibrate(llm.model_name, prompt, response.usage_metadata.prompt_token_count)
+            if head_sha and response.complete:
+                reports[report_key] = response
+        usage = response.usage_metadata
+        st.write(f"Input tokens: {usage.prompt_token_count}")
+        st.write(f"Output tokens: {usage.candidates_token_count}")
          
-        total_tokens = input_tokens.total_tokens + output_tokens.total_tokens
+        total_tokens = usage.total_token_count
         
         st.write(f"Total tokens: {total_tokens}")
         print("Total tokens: ", total_tokens)
         print(response.text)        
-        st.write(response.text)
-        
-        # for chunk in response:
-        #     if chunk:
-        #         processed_data = processed_data + chunk.text
-        #         # st.write("--------------------------------------------------------------------------------------------------")
-        #         print(chunk.text)
         print("Gemini response successfully generated")
-        # st.write(processed_data)
+        if head_sha:
+            # Keep the repository for follow-up questions on the next reruns
+            st.session_state.chat_repo = (local_path, head_sha, spill_file)
     except Exception as e:
         st.write(f"Error generating response: {e}")
         print("Error generating response: ", e)
@@ -195,3 +213,9 @@ if st.button("Submit"):
     #         st.write("Output file deleted.")
     # except Exception as e:
     #     st.write(f"Error deleting files: {e}")
+
+# Follow-up questions about the last analysed repository
+if "chat_repo" in st.session_state:
+    local_path, head_sha, spill_file = st.session_state.chat_repo
+    st.write(f"Repository: {local_path} at {head_sha[:12]}")
+    show_chat(chat_context(local_path, head_sha, spill_file), head_sha)
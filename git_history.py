@@ -0,0 +1,333 @@
+import os
+import datetime
+import subprocess
+import threading
+from collections import deque, namedtuple
+import git
+
+# One commit of a history window, with everything the report needs already parsed
+CommitRecord = namedtuple(
+    "CommitRecord",
+    ["hexsha", "tree", "parents", "author", "email", "committed_datetime", "message", "stats", "files"],
+)
+# One file changed by a commit against its first parent; diff holds the hunks as bytes
+FileChange = namedtuple(
+    "FileChange",
+    ["a_path", "b_path", "new_file", "deleted_file", "renamed_file", "insertions", "deletions", "diff"],
+)
+
+# Commit header fields, NUL-delimited so a single stream can be split back into commits
+LOG_FORMAT = "%x00%H%x1f%T%x1f%P%x1f%an%x1f%ae%x1f%cI%x1f%B%x00"
+
+# Unchanged lines around each hunk in the patches read_history returns
+DIFF_CONTEXT_LINES = int(os.getenv("DIFF_CONTEXT_LINES", 3))
+# Touched files larger than this are left out of touched_files_content
+TOUCHED_FILE_MAX_BYTES = int(os.getenv("TOUCHED_FILE_MAX_BYTES", 64 * 1024))
+
+
+# Long-lived `git cat-file --batch` process for one repository. Object requests are pipelined
+# by SHA and contents come back as memoryviews over the bytes read from the pipe, so large trees
+# are read at git's own speed without re-resolving paths or opening a stream per blob.
+class CatFileReader:
+    # Requests written ahead of the responses being read; kept well below what fits in the stdin
+    # pipe so a write can never block while git is waiting for us to drain stdout
+    WINDOW = 512
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(
+            ["git", "-C", repo_path, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self.process.wait()
+
+    # Read one response: (type, memoryview of the contents), or (None, None) for a missing object
+    def _read_response(self):
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            return None, None
+        size = int(header[2])
+        data = bytearray(size)
+        view = memoryview(data)
+        filled = 0
+        while filled < size:
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                raise EOFError(f"git cat-file closed while reading {header[0].decode()}")
+            filled += count
+        self.process.stdout.read(1)
+        return header[1].decode(), view
+
+    # Yield (sha, type, contents) for every sha, in order, keeping up to WINDOW requests in flight
+    def read_many(self, shas):
+        with self.lock:
+            pending = deque()
+            try:
+                for sha in shas:
+                    self.process.stdin.write(f"{sha}\n".encode())
+                    pending.append(sha)
+                    if len(pending) >= self.WINDOW:
+                        self.process.stdin.flush()
+                        yield (pending.popleft(), *self._read_response())
+                self.process.stdin.flush()
+                while pending:
+                    yield (pending.popleft(), *self._read_response())
+            finally:
+                # A caller that stops early must not leave responses behind for the next request
+                self.process.stdin.flush()
+                while pending:
+                    pending.popleft()
+                    self._read_response()
+
+    def read(self, sha):
+        for _, obj_type, contents in self.read_many([sha]):
+            return obj_type, contents
+
+    # Yield (path, blob sha) for every file under a tree, level by level like Tree.traverse().
+    # Each level of subtrees is fetched in one pipelined batch; submodules are skipped.
+    def iter_tree(self, tree_sha):
+        level = [("", tree_sha)]
+        while level:
+            next_level = []
+            objects = self.read_many([sha for _, sha in level])
+            for (_, _, contents), (prefix, _) in zip(objects, level):
+                data = contents.obj
+                position = 0
+                while position < len(data):
+                    space = data.index(b" ", position)
+                    nul = data.index(b"\0", space)
+                    mode = bytes(data[position:space])
+                    path = prefix + data[space + 1:nul].decode('utf-8', 'replace')
+                    entry_sha = data[nul + 1:nul + 21].hex()
+                    position = nul + 21
+                    if mode == b"40000":
+                        next_level.append((path + "/", entry_sha))
+                    elif mode != b"160000":
+                        yield path, entry_sha
+            level = next_level
+
+
+# One batch reader per repository, shared by every report generated from that checkout
+_readers = {}
+
+
+def batch_reader(repo_path):
+    key = os.path.abspath(repo_path)
+    reader = _readers.get(key)
+    if reader is None or reader.process.poll() is not None:
+        reader = _readers[key] = CatFileReader(repo_path)
+    return reader
+
+
+# Render the files of a commit (a CommitRecord) for the prompt, reading blobs through a CatFileReader.
+# With seen_blobs (blob sha -> path it was first sent under) every unique blob is sent once and
+# later occurrences become a one-line reference. previous is (sha, {path: blob sha}) of the commit
+# rendered just before; files whose blob did not change since then are skipped entirely.
+# Returns the rendered text and the {path: blob sha} of this commit.
+def tree_content(reader, commit, seen_blobs=None, previous=None):
+    tree = {}
+    plan = []
+    unchanged = 0
+    previous_sha, previous_tree = previous if previous else (None, None)
+    for file_path, sha in reader.iter_tree(commit.tree):
+        tree[file_path] = sha
+        if seen_blobs is None:
+            plan.append((file_path, sha, None))
+        elif previous_tree is not None and previous_tree.get(file_path) == sha:
+            unchanged += 1
+        elif sha in seen_blobs:
+            plan.append((file_path, sha, seen_blobs[sha]))
+        else:
+            seen_blobs[sha] = file_path
+            plan.append((file_path, sha, None))
+
+    # Only blobs sent in full are requested, all in one pipelined batch
+    blobs = {sha: data for sha, _, data in reader.read_many([sha for _, sha, first_path in plan if first_path is None])}
+    content = ""
+    for file_path, sha, first_path in plan:
+        if first_path is not None:
+            content += f"\n\n--- {file_path} --- same content as blob {sha[:12]} ({first_path})\n"
+            continue
+        data = blobs[sha]
+        label = file_path if seen_blobs is None else f"{file_path} (blob {sha[:12]})"
+        try:
+            text = str(data, 'utf-8')
+        except UnicodeDecodeError:
+            content += f"\n\n--- {label} --- binary, {len(data)} bytes\n"
+            continue
+        content += f"\n\n--- {label} ---\n\n"
+        content += f"```{text}```"
+
+    if seen_blobs is None:
+        return content, tree
+    header = f"\n\n=== Commit {commit.hexsha[:12]} ===\n"
+    if previous_tree is not None:
+        header += f"{unchanged} files unchanged from commit {previous_sha[:12]}\n"
+        removed = [path for path in previous_tree if path not in tree]
+        if removed:
+            header += f"Not present in this commit: {', '.join(removed)}\n"
+    return header + content, tree
+
+
+# Prompt text for one commit as its message and unified diffs only, without any file contents
+def diff_content(commit):
+    content = f"\n\n=== Commit {commit.hexsha[:12]} by {commit.author} on {commit.committed_datetime} ===\n"
+    content += f"{commit.message}\n"
+    for change in commit.files:
+        status = " (new file)" if change.new_file else " (deleted)" if change.deleted_file else ""
+        content += f"\n--- {change.a_path}{status} +{change.insertions} -{change.deletions} ---\n"
+        content += change.diff.decode('utf-8', 'replace') + "\n"
+    return content
+
+
+# Current contents of every file the commits touched, as of the newest commit (commits are newest
+# first, as read_history yields them). Files created in the window are already whole in the diffs;
+# they and deleted, binary and oversized files are only listed by name.
+def touched_files_content(reader, commits, max_bytes=TOUCHED_FILE_MAX_BYTES):
+    if not commits:
+        return ""
+    touched = set(change.a_path for commit in commits for change in commit.files)
+    created = set(change.a_path for commit in commits for change in commit.files if change.new_file)
+    tree = {path: sha for path, sha in reader.iter_tree(commits[0].tree) if path in touched}
+    blobs = dict((sha, data) for sha, _, data in reader.read_many(sorted(set(tree.values()))))
+    content = "\n\n=== Files touched in this window, as of the newest commit ===\n"
+    for path in sorted(touched):
+        if path not in tree:
+            content += f"\n\n--- {path} --- deleted\n"
+            continue
+        if path in created:
+            content += f"\n\n--- {path} --- new in this window, see the diffs\n"
+            continue
+        data = blobs[tree[path]]
+        if len(data) > max_bytes:
+            content += f"\n\n--- {path} --- {len(data)} bytes, left out\n"
+            continue
+        try:
+            text = str(data, 'utf-8')
+        except UnicodeDecodeError:
+            content += f"\n\n--- {path} --- binary, {len(data)} bytes\n"
+            continue
+        content += f"\n\n--- {path} ---\n\n```{text}```"
+    return content
+
+
+# Parse the numstat lines and patch that follow a commit header
+def _parse_changes(body):
+    numstat, _, patch = body.partition(b"\ndiff --git ")
+    counts = {}
+    for line in numstat.splitlines():
+        if not line:
+            continue
+        insertions, deletions, path = line.decode('utf-8', 'replace').split("\t", 2)
+        # Binary files report "-" for both counts
+        counts[path] = (
+            int(insertions) if insertions != "-" else 0,
+            int(deletions) if deletions != "-" else 0,
+        )
+
+    files = []
+    for section in patch.split(b"\ndiff --git ") if patch else []:
+        header, _, rest = section.partition(b"\n")
+        # Without rename detection the header is "a/<path> b/<path>" with the same path twice
+        header = header.decode('utf-8', 'replace')
+        path = header[2:2 + (len(header) - 5) // 2]
+        new_file = deleted_file = False
+        diff = b""
+        lines = rest.split(b"\n")
+        for index, line in enumerate(lines):
+            if line.startswith(b"new file mode"):
+                new_file = True
+            elif line.startswith(b"deleted file mode"):
+                deleted_file = True
+            elif line.startswith(b"@@") or line.startswith(b"Binary files"):
+                diff = b"\n".join(lines[index:])
+                break
+        insertions, deletions = counts.get(path, (0, 0))
+        files.append(FileChange(path, path, new_file, deleted_file, False, insertions, deletions, diff))
+
+    stats = {
+        "insertions": sum(change.insertions for change in files),
+        "deletions": sum(change.deletions for change in files),
+        "lines": sum(change.insertions + change.deletions for change in files),
+        "files": len(files),
+    }
+    return stats, files
+
+
+# Build a CommitRecord from its header and body as produced by LOG_FORMAT
+def _parse_record(header, body):
+    hexsha, tree, parents, author, email, date, message = header.decode('utf-8', 'replace').split("\x1f", 6)
+    stats, files = _parse_changes(body)
+    return CommitRecord(
+        hexsha, tree, parents.split(), author, email,
+        datetime.datetime.fromisoformat(date), message.rstrip("\n"), stats, files,
+    )
+
+
+# Read a whole history window with a single streamed `git log`: authors, dates, messages,
+# numstat and first-parent patches (with context_lines of context) for every commit, yielded
+# newest first as CommitRecords. This replaces one commit.stats and one commit.diff subprocess per commit.
+def read_history(repo_path, since=None, rev="HEAD", context_lines=DIFF_CONTEXT_LINES):
+    args = [
+        "git", "-C", repo_path, "-c", "core.quotePath=false", "log", "--no-color", "--no-renames",
+        "--diff-merges=first-parent", "--numstat", "--patch", f"-U{context_lines}", f"--format={LOG_FORMAT}",
+    ]
+    if since:
+        args.append(f"--since={since}")
+    args.append(rev)
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE)
+    try:
+        pending = bytearray()
+        scanned = 0
+        pieces = []
+        for block in iter(lambda: process.stdout.read(1 << 16), b""):
+            pending += block
+            while True:
+                end = pending.find(b"\0", scanned)
+                if end < 0:
+                    scanned = len(pending)
+                    break
+                pieces.append(bytes(pending[:end]))
+                del pending[:end + 1]
+                scanned = 0
+            # Pieces run "", header, body, header, body, ...; a body is complete once the next header starts
+            while len(pieces) >= 4:
+                yield _parse_record(pieces[1], pieces[2])
+                del pieces[1:3]
+        if len(pieces) >= 2:
+            pieces.append(bytes(pending))
+            yield _parse_record(pieces[1], pieces[2])
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise git.exc.GitCommandError(args, returncode)
+
+
+# Paths touched by the last few commits mapped to their recency rank (0 = most recent),
+# from a single `git log --name-only`
+def recent_paths(repo_path, commits=50):
+    output = subprocess.run(
+        ["git", "-C", repo_path, "-c", "core.quotePath=false", "log", "--no-renames",
+         "--name-only", "--format=", f"-n{commits}"],
+        stdout=subprocess.PIPE, check=True,
+    ).stdout.decode('utf-8', 'replace')
+    paths = {}
+    for path in output.splitlines():
+        if path:
+            paths.setdefault(path, len(paths))
+    return paths
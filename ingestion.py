@@ -0,0 +1,377 @@
+import os
+import mmap
+import hashlib
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import git
+from tracing import count, traced
+
+# Directory holding decoded file contents keyed by git blob SHA, shared by every checkout
+SNAPSHOT_CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", "./.snapshot_cache")
+# Disk quota for the snapshot cache; least recently used entries are removed after an ingestion
+SNAPSHOT_CACHE_MAX_BYTES = int(os.getenv("SNAPSHOT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# Approximate size in characters of each prompt part handed to the model
+PROMPT_PART_SIZE = int(os.getenv("PROMPT_PART_SIZE", 1 << 20))
+
+# Threads reading and decoding files; 1 reads them one at a time on the calling thread
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 8))
+
+# Files that are skipped from their path alone, before anything is read
+BINARY_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".tif", ".tiff", ".psd", ".pdf",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".tar", ".jar", ".war", ".whl", ".egg",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot", ".mp3", ".mp4", ".wav", ".ogg", ".mov", ".avi", ".webm",
+    ".so", ".dll", ".dylib", ".exe", ".bin", ".o", ".a", ".class", ".pyc", ".pyo", ".wasm",
+    ".sqlite", ".db", ".pkl", ".npy", ".npz", ".h5", ".onnx", ".pt", ".parquet",
+}
+GENERATED_NAMES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "pipfile.lock", "cargo.lock",
+    "gemfile.lock", "composer.lock", "go.sum", "uv.lock",
+}
+GENERATED_SUFFIXES = (".min.js", ".min.css", ".map", ".pb.go", "_pb2.py", ".bundle.js")
+VENDOR_DIRS = {"node_modules", "vendor", "third_party", "bower_components", ".yarn"}
+
+# Size caps: one for every file and tighter ones for data-like extensions
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", 1 << 20))
+EXTENSION_MAX_BYTES = {
+    ".json": 256 * 1024, ".xml": 256 * 1024, ".txt": 256 * 1024, ".ipynb": 512 * 1024,
+    ".csv": 64 * 1024, ".tsv": 64 * 1024, ".log": 64 * 1024, ".svg": 32 * 1024,
+}
+
+# Bytes checked for NUL before a file is read in full
+SNIFF_BYTES = 8192
+
+
+# Location of a cache entry for a blob SHA (fanned out like .git/objects)
+def _cache_path(kind, sha):
+    return os.path.join(SNAPSHOT_CACHE_DIR, kind, sha[:2], sha[2:])
+
+
+# Bytes written to the snapshot cache since it was last evicted
+_written = 0
+_written_lock = threading.Lock()
+# Bytes read by read_blob_text in this process, from working tree files and from cache hits
+_read_bytes = {"files": 0, "cache": 0}
+
+
+def _add_read(source, size):
+    with _written_lock:
+        _read_bytes[source] += size
+
+
+# Copy of the read totals, e.g. to tell how much of an ingestion came from the snapshot cache
+def bytes_read():
+    with _written_lock:
+        return dict(_read_bytes)
+
+
+# Write a cache entry atomically so an interrupted run never leaves half a file behind
+def _write_cache(cache_path, content):
+    global _written
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Two threads can cache the same blob when files share content, so the temp name is per thread
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as cache_file:
+        cache_file.write(content)
+    os.replace(tmp_path, cache_path)
+    with _written_lock:
+        _written += len(content) + 1
+
+
+# Remove least recently used entries (by modification time, refreshed on every hit) until the
+# snapshot cache is within max_bytes. Only walks the cache when something was written since last time.
+def evict_snapshot_cache(max_bytes=SNAPSHOT_CACHE_MAX_BYTES):
+    global _written
+    with _written_lock:
+        if not _written:
+            return
+        _written = 0
+    entries = []
+    total = 0
+    for root, _, files in os.walk(SNAPSHOT_CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            entry_path = os.path.join(root, name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total += stat.st_size
+    for _, size, entry_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        total -= size
+
+
+# Git object id of a blob with the given bytes, to tell whether a working tree file is its HEAD blob
+def _blob_sha(data, like_sha):
+    digest = hashlib.sha1() if len(like_sha) == 40 else hashlib.sha256()
+    digest.update(b"blob %d\0" % len(data))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+# List (path, blob sha, size in bytes) for every file in the HEAD tree without walking the .git directory
+def list_head_blobs(repo):
+    output = repo.git.ls_tree("-r", "-z", "-l", "--full-tree", "HEAD")
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        mode, obj_type, sha, size = meta.split()
+        # Submodules show up as "commit" entries and have no content here
+        if obj_type == "blob":
+            yield path, sha, int(size)
+
+
+# Reason a file should not be sent to the model, judged from its path and size alone
+def _skip_reason(path, size):
+    name = os.path.basename(path).lower()
+    extension = os.path.splitext(name)[1]
+    if extension in BINARY_EXTENSIONS:
+        return "binary"
+    if name in GENERATED_NAMES or name.endswith(GENERATED_SUFFIXES):
+        return "generated"
+    if any(part in VENDOR_DIRS for part in path.split("/")[:-1]):
+        return "vendored"
+    if size > EXTENSION_MAX_BYTES.get(extension, MAX_FILE_BYTES):
+        return "too large"
+    return None
+
+
+# Tracked files that still match a .gitignore pattern (committed build output and the like)
+def _ignored_paths(repo):
+    output = repo.git.ls_files("-z", "--cached", "--ignored", "--exclude-standard")
+    return set(path for path in output.split("\0") if path)
+
+
+# Files marked linguist-generated, linguist-vendored or binary in .gitattributes
+def _attribute_skips(repo, paths):
+    args = ["git", "-C", repo.working_dir, "check-attr", "-z", "--stdin",
+            "linguist-generated", "linguist-vendored", "binary"]
+    output = subprocess.run(
+        args, input="\0".join(paths).encode('utf-8') + b"\0" if paths else b"",
+        stdout=subprocess.PIPE, check=True,
+    ).stdout.decode('utf-8', 'replace').split("\0")
+    reasons = {"linguist-generated": "generated", "linguist-vendored": "vendored", "binary": "binary"}
+    skips = {}
+    for index in range(0, len(output) - 2, 3):
+        path, attribute, value = output[index:index + 3]
+        if value in ("set", "true"):
+            skips.setdefault(path, reasons[attribute])
+    return skips
+
+
+# Drop binary, generated, vendored, ignored and oversized files from list_head_blobs entries
+# without reading them. Skipped paths are added to report ({reason: [paths]}) when given.
+def filter_entries(repo, entries, report=None):
+    entries = list(entries)
+    ignored = _ignored_paths(repo)
+    attribute_skips = {}
+    # check-attr is only worth a subprocess when the repository has attributes to check
+    if any(os.path.basename(path) == ".gitattributes" for path, _, _ in entries):
+        attribute_skips = _attribute_skips(repo, [path for path, _, _ in entries])
+    kept = []
+    for path, blob_sha, size in entries:
+        reason = _skip_reason(path, size) or attribute_skips.get(path)
+        if reason is None and path in ignored:
+            reason = "ignored"
+        if reason is None:
+            kept.append((path, blob_sha, size))
+        elif report is not None:
+            report.setdefault(reason, []).append(path)
+    return kept
+
+
+# list_head_blobs entries that are worth sending to the model
+def list_repo_files(repo, report=None):
+    return filter_entries(repo, list_head_blobs(repo), report)
+
+
+# One line summary of a filter report, e.g. "Skipped 12 files: 9 binary, 3 generated"
+def format_skip_report(report):
+    total = sum(len(paths) for paths in report.values())
+    details = ", ".join(f"{len(paths)} {reason}" for reason, paths in sorted(report.items()))
+    return f"Skipped {total} files: {details}"
+
+
+# Number of commits reachable from HEAD, cached per HEAD SHA
+def count_commits(repo):
+    head_sha = repo.head.commit.hexsha
+    cache_path = _cache_path("commits", head_sha)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as cache_file:
+            return int(cache_file.read())
+    commits = int(repo.git.rev_list("--count", "HEAD"))
+    _write_cache(cache_path, str(commits))
+    return commits
+
+
+# Decoded text of a tracked file, read from disk only when its blob is not cached yet.
+# Returns None for binary files (a NUL in the first SNIFF_BYTES) and files that are not valid
+# UTF-8; both are remembered so they are not read again. The working tree file is only cached
+# under blob_sha when it is that blob: an edited file or one changed by a filter (LFS, eol
+# conversion) is returned as it is but read again next time.
+def read_blob_text(repo_path, path, blob_sha):
+    cache_path = _cache_path("blobs", blob_sha)
+    try:
+        with open(cache_path, 'r', encoding='utf-8', newline='') as cache_file:
+            content = cache_file.read()
+            _add_read("cache", os.fstat(cache_file.fileno()).st_size)
+        # The modification time doubles as the last-used time for eviction
+        os.utime(cache_path)
+        return content
+    except FileNotFoundError:
+        pass
+    if os.path.exists(cache_path + ".skip"):
+        return None
+
+    file_path = os.path.join(repo_path, path)
+    data = b""
+    try:
+        with open(file_path, 'rb') as infile:
+            head = infile.read(SNIFF_BYTES)
+            data = head + infile.read()
+        _add_read("files", len(data))
+        if b"\0" in head:
+            if _blob_sha(data, blob_sha) == blob_sha:
+                _write_cache(cache_path + ".skip", "")
+            return None
+        # Same newline handling as reading the file in text mode
+        content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    except UnicodeDecodeError as e:
+        print(f"Error reading {file_path}: {e}")
+        if _blob_sha(data, blob_sha) == blob_sha:
+            _write_cache(cache_path + ".skip", "")
+        return None
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+    if _blob_sha(data, blob_sha) == blob_sha:
+        _write_cache(cache_path, content)
+    else:
+        count("uncached_files")
+    return content
+
+
+# read_blob_text for every entry on a pool of worker threads, yielding (entry, content) in entry
+# order. At most a few reads per worker are in flight, so results never pile up in memory.
+def _read_parallel(repo_path, entries, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for entry in entries:
+            path, blob_sha, _ = entry
+            pending.append((entry, executor.submit(read_blob_text, repo_path, path, blob_sha)))
+            if len(pending) >= workers * 4:
+                entry, future = pending.popleft()
+                yield entry, future.result()
+        while pending:
+            entry, future = pending.popleft()
+            yield entry, future.result()
+
+
+# Yield (file_path, content) for every file tracked at HEAD that passes filter_entries,
+# or only for the given entries. Skipped files are added to report when given, and every file
+# read is added to indexer (a code_search.SearchIndex) when given.
+def iter_repo_files(repo_path, repo=None, entries=None, report=None, workers=INGEST_WORKERS, indexer=None):
+    if entries is None:
+        entries = list_repo_files(repo or git.Repo(repo_path), report)
+    if workers > 1:
+        contents = _read_parallel(repo_path, entries, workers)
+    else:
+        contents = ((entry, read_blob_text(repo_path, entry[0], entry[1])) for entry in entries)
+    for (path, blob_sha, size), content in contents:
+        if content is not None:
+            count("files")
+            count("bytes", size)
+            if indexer is not None:
+                indexer.add(path, blob_sha, content)
+            yield os.path.join(repo_path, path), content
+        elif report is not None:
+            report.setdefault("binary or unreadable", []).append(path)
+    evict_snapshot_cache()
+
+
+# Yield the repository text piece by piece, in the order it appears in the prompt.
+# A compaction.Compactor, when given, compacts the files and folds duplicates.
+def iter_repo_chunks(repo_path, entries=None, report=None, workers=INGEST_WORKERS, compactor=None):
+    repo = git.Repo(repo_path)
+    yield f"Total commits: {count_commits(repo)}\n\n"
+    files = iter_repo_files(repo_path, repo, entries, report, workers)
+    if compactor is not None:
+        files = compactor.files(files)
+    for file_path, content in files:
+        yield f"\n\n--- {file_path} ---\n\n"
+        yield content
+
+
+# Group chunks into parts of about part_size characters so the prompt has a few large parts
+def coalesce_chunks(chunks, part_size=PROMPT_PART_SIZE):
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= part_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+# Prompt parts kept in a memory-mapped spill file and decoded one at a time on iteration
+class SpilledParts:
+    def __init__(self, spill_file, offsets):
+        self.spill_file = spill_file
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        if not self.offsets:
+            return
+        with open(self.spill_file, 'rb') as infile:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start, end in self.offsets:
+                    yield mapped[start:end].decode('utf-8')
+
+
+# Write parts to spill_file as they are produced, remembering where each one starts and ends
+def spill_chunks(parts, spill_file):
+    offsets = []
+    with open(spill_file, 'wb') as outfile:
+        for part in parts:
+            start = outfile.tell()
+            outfile.write(part.encode('utf-8'))
+            offsets.append((start, outfile.tell()))
+    return SpilledParts(spill_file, offsets)
+
+
+# Ingest a repository into prompt parts. With spill_file set the parts live on disk
+# and are only decoded when the prompt is sent, which keeps very large repos off the heap.
+# entries restricts ingestion to part of the tree, e.g. one chunk planned by prompt_packer.
+@traced("ingest")
+def read_repo_parts(repo_path, spill_file=None, entries=None, report=None, workers=INGEST_WORKERS, compactor=None):
+    parts = coalesce_chunks(iter_repo_chunks(repo_path, entries, report, workers, compactor))
+    if spill_file:
+        return spill_chunks(parts, spill_file)
+    return list(parts)
+
+
+# Function to read files from a repository and append their content to an output file
+@traced("ingest")
+def read_and_append_files(repo_path, output_file):
+    with open(output_file, 'w') as outfile:
+        for chunk in iter_repo_chunks(repo_path):
+            outfile.write(chunk)
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from tracing import span, trace_spans
+
+# Background jobs shared by every session of the Streamlit server. Each job is a JSON file in
+# JOBS_DIR holding its status, progress messages, streamed text and result, so a page can poll
+# or reattach by job ID after a rerun or reconnect, and unfinished jobs resume after a restart.
+JOBS_DIR = os.getenv("JOBS_DIR", "./.jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Finished jobs are removed after this many seconds
+JOB_TTL = int(os.getenv("JOB_TTL", 7 * 24 * 3600))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+# Streamed text is written to disk at most this often; status changes are written at once
+TEXT_FLUSH_SECONDS = 1.0
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, jobs_dir=JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.handlers = {}
+        self.jobs = {}
+        self.lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, job_id + ".json")
+
+    def _save(self, job):
+        job_path = self._job_path(job["id"])
+        tmp_path = f"{job_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as job_file:
+            json.dump(job, job_file)
+        os.replace(tmp_path, job_path)
+
+    def _load(self, job_id):
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as job_file:
+                return json.load(job_file)
+        except (OSError, ValueError):
+            return None
+
+    def _update(self, job_id, save=True, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(fields, updated=time.time())
+            if save:
+                self._save(job)
+
+    # Register the function that runs jobs of a kind: handler(progress, on_text, **params) returns
+    # a JSON-serialisable result. Jobs of this kind left queued or running by an earlier server
+    # process are picked up again.
+    def register(self, kind, handler):
+        if self.handlers.get(kind) is handler:
+            return
+        self.handlers[kind] = handler
+        for job in self.list(ACTIVE):
+            if job["kind"] == kind and job["id"] not in self.jobs:
+                print(f"Resuming job {job['id']}")
+                with self.lock:
+                    self.jobs[job["id"]] = job
+                self._update(job["id"], status=QUEUED, progress=[], text="")
+                self.executor.submit(self._run, job["id"])
+
+    # Queue a job and return its ID. An identical job that is still queued or running is shared
+    # instead of starting the same analysis twice.
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for {kind} jobs")
+        with self.lock:
+            for job in self.jobs.values():
+                if job["kind"] == kind and job["params"] == params and job["status"] in ACTIVE:
+                    return job["id"]
+            job_id = uuid.uuid4().hex[:12]
+            now = time.time()
+            job = {
+                "id": job_id, "kind": kind, "params": params, "status": QUEUED,
+                "progress": [], "text": "", "result": None, "error": None,
+                "created": now, "updated": now,
+            }
+            self.jobs[job_id] = job
+            self._save(job)
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def _run(self, job_id):
+        job = self.jobs[job_id]
+        self._update(job_id, status=RUNNING)
+        last_flush = [0.0]
+
+        def progress(message):
+            print(f"[{job_id}] {message}")
+            with self.lock:
+                job["progress"].append(message)
+            self._update(job_id)
+
+        def on_text(text):
+            now = time.monotonic()
+            flush = now - last_flush[0] >= TEXT_FLUSH_SECONDS
+            if flush:
+                last_flush[0] = now
+            self._update(job_id, save=flush, text=text)
+
+        try:
+            with span(f"job {job['kind']}", job_id=job_id) as job_span:
+                result = self.handlers[job["kind"]](progress, on_text, **job["params"])
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=FAILED, error=str(e), timings=trace_spans(job_span.trace_id))
+            return
+        self._update(job_id, status=DONE, result=result, text=(result or {}).get("text", job["text"]),
+                     timings=trace_spans(job_span.trace_id))
+
+    # Current state of a job as a dict, or None for an unknown ID. Jobs of this process are read
+    # from memory, others (e.g. finished before a restart) from disk.
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return json.loads(json.dumps(job))
+        return self._load(job_id)
+
+    # Every stored job, newest first, optionally only those with a status in statuses.
+    # Finished jobs older than JOB_TTL are deleted on the way.
+    def list(self, statuses=None):
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith(".json"):
+                continue
+            job = self.get(name[:-len(".json")])
+            if job is None:
+                continue
+            if job["status"] not in ACTIVE and time.time() - job["updated"] > JOB_TTL:
+                os.remove(self._job_path(job["id"]))
+                with self.lock:
+                    self.jobs.pop(job["id"], None)
+                continue
+            if statuses is None or job["status"] in statuses:
+                jobs.append(job)
+        return sorted(jobs, key=lambda job: job["created"], reverse=True)
+
+
+_default_queue = None
+_default_lock = threading.Lock()
+
+
+# The queue shared by every page and session of this server process
+def default_queue():
+    global _default_queue
+    with _default_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue()
+        return _default_queue
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import smtplib
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from tracing import count, traced
+
+# SMTP server the reports are sent through. Login and STARTTLS can be turned off to send through a
+# local stand-in, e.g. `python -m aiosmtpd -n -l localhost:8025` with SMTP_HOST=localhost,
+# SMTP_PORT=8025 and SMTP_STARTTLS=0
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", 30))
+# Messages sent over one authenticated connection
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", 4))
+# Per-recipient delivery status of recent messages
+MAIL_STATUS_FILE = os.getenv("MAIL_STATUS_FILE", "./.mail_status.json")
+MAIL_STATUS_KEEP = 1000
+
+QUEUED = "queued"
+RETRYING = "retrying"
+SENT = "sent"
+FAILED = "failed"
+
+
+# Sends queued messages on a background thread. Messages waiting at the same time go out as one
+# batch over a single connection with one STARTTLS and login; a dropped connection or temporary
+# (4xx) error retries the rest of the batch with exponential backoff, while a recipient the server
+# refuses is marked failed without holding up the others.
+class Mailer:
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=None, password=None,
+                 starttls=SMTP_STARTTLS, batch_size=MAIL_BATCH_SIZE, max_retries=MAIL_MAX_RETRIES,
+                 status_file=MAIL_STATUS_FILE):
+        self.host = host
+        self.port = port
+        self.username = username if username is not None else os.getenv('EMAIL_ADDRESS')
+        self.password = password if password is not None else os.getenv('EMAIL_PASSWORD')
+        self.from_email = os.getenv('MAIL_FROM') or self.username
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.status_file = status_file
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.status = self._load_status()
+        threading.Thread(target=self._worker, name="mailer", daemon=True).start()
+
+    def _load_status(self):
+        try:
+            with open(self.status_file, 'r', encoding='utf-8') as status_file:
+                return json.load(status_file)
+        except (OSError, ValueError):
+            return {}
+
+    # Write the status of the most recent messages; called with the lock held
+    def _save_status(self):
+        for message_id in sorted(self.status, key=lambda key: self.status[key]["updated"])[:-MAIL_STATUS_KEEP]:
+            del self.status[message_id]
+        tmp_path = f"{self.status_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as status_file:
+            json.dump(self.status, status_file)
+        os.replace(tmp_path, self.status_file)
+
+    def _set_status(self, message_ids, status, error=None):
+        with self.lock:
+            for message_id in message_ids:
+                entry = self.status[message_id]
+                entry.update(status=status, error=error, updated=time.time())
+                if status == RETRYING:
+                    entry["attempts"] += 1
+            self._save_status()
+
+    # Queue one message per recipient and return their message IDs; delivery happens in the background
+    def send(self, subject, body, to_emails):
+        if isinstance(to_emails, str):
+            to_emails = [to_emails]
+        messages = []
+        with self.lock:
+            for to_email in to_emails:
+                msg = MIMEMultipart()
+                msg['From'] = self.from_email
+                msg['To'] = to_email
+                msg['Subject'] = subject
+                msg.attach(MIMEText(body, 'plain'))
+                message_id = uuid.uuid4().hex[:12]
+                self.status[message_id] = {
+                    "to": to_email, "subject": subject, "status": QUEUED,
+                    "attempts": 0, "error": None, "updated": time.time(),
+                }
+                messages.append((message_id, msg))
+            self._save_status()
+        for message in messages:
+            self.queue.put(message)
+        return [message_id for message_id, _ in messages]
+
+    # Delivery status of a message: to, subject, status, attempts and the last error
+    def get_status(self, message_id):
+        with self.lock:
+            return dict(self.status.get(message_id) or {})
+
+    # Block until every queued message is sent or has failed
+    def flush(self):
+        self.queue.join()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            if self.starttls:
+                server.starttls()  # Upgrade the connection to a secure encrypted SSL/TLS connection
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _worker(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                print(f"Failed to send email batch. Error: {str(e)}")
+                self._set_status([message_id for message_id, _ in batch if self.get_status(message_id)["status"] != SENT], FAILED, str(e))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    @traced("smtp_batch")
+    def _send_batch(self, batch):
+        pending = list(batch)
+        attempt = 0
+        while pending:
+            try:
+                with self._connect() as server:
+                    while pending:
+                        message_id, msg = pending[0]
+                        try:
+                            server.send_message(msg)
+                        except smtplib.SMTPRecipientsRefused as e:
+                            print(f"Failed to send email to {msg['To']}. Error: {e.recipients}")
+                            self._set_status([message_id], FAILED, str(e.recipients))
+                            count("failed")
+                        except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                            if e.smtp_code < 500:
+                                raise
+                            print(f"Failed to send email to {msg['To']}. Error: {e}")
+                            self._set_status([message_id], FAILED, str(e))
+                            count("failed")
+                        else:
+                            print(f"Email sent to {msg['To']}")
+                            self._set_status([message_id], SENT)
+                            count("sent")
+                        pending.pop(0)
+            except smtplib.SMTPAuthenticationError as e:
+                print(f"Failed to log in to {self.host}. Error: {str(e)}")
+                self._set_status([message_id for message_id, _ in pending], FAILED, str(e))
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    print(f"Failed to send email. Error: {str(e)}")
+                    self._set_status([message_id for message_id, _ in pending], FAILED, str(e))
+                    return
+                delay = min(2 ** attempt, 300) * (0.5 + random.random())
+                print(f"Email delivery failed ({e}), retrying {len(pending)} messages in {delay:.1f}s")
+                self._set_status([message_id for message_id, _ in pending], RETRYING, str(e))
+                count("retries")
+                time.sleep(delay)
+
+
+_default_mailer = None
+_default_lock = threading.Lock()
+
+
+# The mailer shared by everything in this process
+def default_mailer():
+    global _default_mailer
+    with _default_lock:
+        if _default_mailer is None:
+            _default_mailer = Mailer()
+        return _default_mailer
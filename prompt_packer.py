@@ -0,0 +1,106 @@
+import os
+from token_estimator import estimate_size_tokens, estimate_tokens
+
+# Input token limits of the Gemini models used by the apps
+MODEL_INPUT_LIMITS = {
+    "gemini-1.5-flash": 1048576,
+    "gemini-1.5-pro": 2097152,
+}
+
+# Share of the input window that is filled, leaving room for estimates that come out low
+SAFETY_MARGIN = 0.9
+
+# Upper bound on map calls for one analysis; the lowest ranked files beyond it are left out
+MAX_MAP_CHUNKS = int(os.getenv("MAX_MAP_CHUNKS", 40))
+
+# Files that usually show how a project is put together, sent first
+ENTRY_POINT_NAMES = {
+    "readme.md", "readme.rst", "readme", "main.py", "app.py", "__main__.py", "manage.py", "setup.py",
+    "pyproject.toml", "requirements.txt", "package.json", "index.js", "index.ts", "main.js", "main.ts",
+    "main.go", "go.mod", "main.rs", "cargo.toml", "pom.xml", "build.gradle", "gemfile", "dockerfile",
+    "makefile",
+}
+
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".java", ".kt", ".scala", ".rb", ".php", ".c",
+    ".h", ".cc", ".cpp", ".hpp", ".cs", ".swift", ".m", ".sh", ".sql", ".vue", ".svelte", ".ex", ".exs",
+}
+
+# Data and generated assets, sent last
+ASSET_EXTENSIONS = {
+    ".json", ".csv", ".tsv", ".svg", ".lock", ".map", ".xml", ".txt", ".log", ".min.js", ".min.css",
+    ".snap", ".pb", ".ipynb",
+}
+
+
+# Input token limit for a model name such as "models/gemini-1.5-flash" (MODEL_INPUT_TOKENS overrides)
+def input_token_limit(model_name):
+    override = os.getenv("MODEL_INPUT_TOKENS")
+    if override:
+        return int(override)
+    return MODEL_INPUT_LIMITS.get(model_name.split("/")[-1], MODEL_INPUT_LIMITS["gemini-1.5-flash"])
+
+
+# Tokens a file takes in the prompt, from its size alone so packing happens before anything is read
+def estimate_file_tokens(path, size, model_name=None):
+    return estimate_size_tokens(size + len(path) + 12, model_name)
+
+
+# Tokens left for repository files once the fixed prompt text is accounted for
+def prompt_budget(model_name, *prompt_texts):
+    fixed = sum(estimate_tokens(text, model_name) for text in prompt_texts)
+    return int(input_token_limit(model_name) * SAFETY_MARGIN) - fixed
+
+
+# 0 = entry point, 1 = source, 2 = other text, 3 = data or generated asset
+def _category(path):
+    name = os.path.basename(path).lower()
+    if name in ENTRY_POINT_NAMES:
+        return 0
+    if name.endswith((".min.js", ".min.css")) or os.path.splitext(name)[1] in ASSET_EXTENSIONS:
+        return 3
+    if os.path.splitext(name)[1] in SOURCE_EXTENSIONS:
+        return 1
+    return 2
+
+
+# Order (path, sha, size) entries by importance: entry points, then source over assets,
+# recently changed files first within a category, then smaller files first
+def rank_entries(entries, recent=None):
+    recent = recent or {}
+    return sorted(entries, key=lambda entry: (
+        _category(entry[0]), recent.get(entry[0], len(recent)), entry[2], entry[0],
+    ))
+
+
+# Plan how the repository goes into the prompt. Returns (chunks, skipped): a single chunk in tree
+# order when everything fits the budget, otherwise ranked chunks of at most budget tokens each for
+# a map-reduce analysis. Files that do not fit anywhere within max_chunks are returned as skipped.
+def plan_chunks(entries, budget, recent=None, max_chunks=MAX_MAP_CHUNKS, model_name=None):
+    entries = list(entries)
+    if sum(estimate_file_tokens(path, size, model_name) for path, _, size in entries) <= budget:
+        return [entries], []
+
+    chunks = []
+    current = []
+    used = 0
+    skipped = []
+    for entry in rank_entries(entries, recent):
+        tokens = estimate_file_tokens(entry[0], entry[2], model_name)
+        if tokens > budget:
+            skipped.append(entry)
+            continue
+        if used + tokens > budget:
+            # Once the last chunk is open, keep filling it with whatever still fits
+            if len(chunks) + 1 >= max_chunks:
+                skipped.append(entry)
+                continue
+            chunks.append(current)
+            current = []
+            used = 0
+        current.append(entry)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks, skipped
+
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+
+# Disk cache of Gemini responses keyed by model, generation_config and prompt
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./.llm_cache")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+
+
+USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "total_token_count")
+
+
+# Plain dict of the token counts in a response's usage_metadata
+def usage_dict(usage):
+    return {name: getattr(usage, name, 0) or 0 for name in USAGE_FIELDS}
+
+
+# Stand-in for a GenerateContentResponse read back from the cache. finish_reason is the name of
+# the reason generation stopped; only complete ("STOP") responses are cached.
+class CachedResponse:
+    def __init__(self, text, usage_metadata, finish_reason="STOP"):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(**usage_metadata)
+        self.finish_reason = finish_reason
+
+    @property
+    def complete(self):
+        return bool(self.text) and self.finish_reason == "STOP"
+
+    def resolve(self):
+        pass
+
+
+# Cache key for a call: model name, generation_config and the prompt (a string or a list of parts),
+# hashed part by part so a large prompt is never joined into one string
+def cache_key(llm, prompt):
+    generation_config = getattr(llm, "_generation_config", None) or {}
+    digest = hashlib.sha256()
+    digest.update(llm.model_name.encode())
+    digest.update(json.dumps(generation_config, sort_keys=True, default=str).encode())
+    for part in [prompt] if isinstance(prompt, str) else prompt:
+        digest.update(b"\0")
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(LLM_CACHE_DIR, key[:2], key + ".json")
+
+
+# Cached response for a key, or None when missing or older than LLM_CACHE_TTL
+def load(key):
+    entry_path = _entry_path(key)
+    try:
+        with open(entry_path, 'r', encoding='utf-8') as entry_file:
+            entry = json.load(entry_file)
+    except (OSError, ValueError):
+        return None
+    # The entry can expire or be evicted by another thread or process meanwhile; that is a miss too
+    try:
+        if time.time() - entry["created"] > LLM_CACHE_TTL:
+            os.remove(entry_path)
+            return None
+        # The modification time doubles as the last-used time for LRU eviction
+        os.utime(entry_path)
+    except OSError:
+        return None
+    return CachedResponse(entry["text"], entry["usage_metadata"])
+
+
+def store(key, response):
+    entry = {
+        "created": time.time(),
+        "text": response.text,
+        "usage_metadata": usage_dict(getattr(response, "usage_metadata", None)),
+    }
+    entry_path = _entry_path(key)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    # Two threads can store the same prompt at once, so the temp name is per thread
+    tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as entry_file:
+        json.dump(entry, entry_file)
+    os.replace(tmp_path, entry_path)
+    evict()
+
+
+# Remove least recently used entries until the cache is within LLM_CACHE_MAX_BYTES
+def evict(max_bytes=LLM_CACHE_MAX_BYTES):
+    entries = []
+    total = 0
+    for root, _, files in os.walk(LLM_CACHE_DIR):
+        for name in files:
+            if name.endswith(".json"):
+                entry_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+                total += stat.st_size
+    for _, size, entry_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        total -= size
+
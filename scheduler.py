@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Recurring report schedules, persisted so they survive restarts. The schedules file is the
+# source of truth and is re-read on every tick, so schedules added by the Streamlit pages are
+# picked up by a scheduler running in another process (python scheduler.py). That process runs
+# schedules right after a restart; the thread the pages start (helper.report_scheduler) only runs
+# once a page has been opened.
+SCHEDULES_FILE = os.getenv("SCHEDULES_FILE", "./.schedules.json")
+# Seconds between checks for due schedules
+SCHEDULER_TICK = int(os.getenv("SCHEDULER_TICK", 30))
+# Due schedules run concurrently on this many threads
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 4))
+
+WEEK = 7 * 24 * 3600
+
+
+# Runs run(**params) for every schedule that is due. A schedule that was missed while nothing
+# was running fires once, not once per missed interval.
+class Scheduler:
+    def __init__(self, run, schedules_file=SCHEDULES_FILE, workers=SCHEDULER_WORKERS):
+        self.run = run
+        self.schedules_file = schedules_file
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="schedule")
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def _load(self):
+        try:
+            with open(self.schedules_file, 'r', encoding='utf-8') as schedules_file:
+                return json.load(schedules_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, schedules):
+        tmp_path = f"{self.schedules_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # Schedules hold repository tokens, so the file is only readable by its owner
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as schedules_file:
+            json.dump(schedules, schedules_file, indent=2)
+        os.replace(tmp_path, self.schedules_file)
+
+    def _modify(self, schedule_id, **fields):
+        with self.lock:
+            schedules = self._load()
+            if schedule_id in schedules:
+                schedules[schedule_id].update(fields)
+                self._save(schedules)
+
+    # Add a schedule, or replace the one with the same name, and return its ID. The first run is
+    # at first_run (a timestamp), by default one interval from now.
+    def add(self, name, params, interval=WEEK, first_run=None):
+        with self.lock:
+            schedules = self._load()
+            schedule_id = next((key for key, value in schedules.items() if value["name"] == name), None)
+            schedule_id = schedule_id or uuid.uuid4().hex[:12]
+            schedules[schedule_id] = {
+                "name": name, "params": params, "interval": interval,
+                "next_run": first_run if first_run is not None else time.time() + interval,
+                "last_run": None, "last_status": None,
+            }
+            self._save(schedules)
+        return schedule_id
+
+    def remove(self, schedule_id):
+        with self.lock:
+            schedules = self._load()
+            if schedules.pop(schedule_id, None) is not None:
+                self._save(schedules)
+
+    def list(self):
+        with self.lock:
+            return self._load()
+
+    # Start every due schedule that is not still running from an earlier tick
+    def tick(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            schedules = self._load()
+            due = []
+            for schedule_id, entry in schedules.items():
+                if entry["next_run"] <= now and schedule_id not in self.running:
+                    # Move next_run past now before starting, so a restart mid-run does not repeat it
+                    while entry["next_run"] <= now:
+                        entry["next_run"] += entry["interval"]
+                    self.running.add(schedule_id)
+                    due.append((schedule_id, entry))
+            if due:
+                self._save(schedules)
+        return [self.executor.submit(self._run, schedule_id, entry) for schedule_id, entry in due]
+
+    def _run(self, schedule_id, entry):
+        print(f"Running schedule {entry['name']}")
+        try:
+            self.run(**entry["params"])
+            status = "ok"
+        # The report helpers exit() on clone errors; that must not take the scheduler down
+        except (Exception, SystemExit) as e:
+            traceback.print_exc()
+            status = f"failed: {e}"
+        finally:
+            with self.lock:
+                self.running.discard(schedule_id)
+        self._modify(schedule_id, last_run=time.time(), last_status=status)
+        print(f"Schedule {entry['name']}: {status}")
+
+    # Tick every SCHEDULER_TICK seconds until stop() is called
+    def serve_forever(self, tick=SCHEDULER_TICK):
+        while not self.stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                traceback.print_exc()
+            self.stopped.wait(tick)
+
+    def start(self, tick=SCHEDULER_TICK):
+        thread = threading.Thread(target=self.serve_forever, args=(tick,), name="scheduler", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    from helper import send_scheduled_report
+    print(f"Scheduler started, checking {SCHEDULES_FILE} every {SCHEDULER_TICK}s")
+    Scheduler(send_scheduled_report).serve_forever()
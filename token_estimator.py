@@ -0,0 +1,75 @@
+import os
+import json
+import threading
+
+# Local token estimates so budgeting and the token display need no count_tokens round trip.
+# The raw estimate is chars / CHARS_PER_TOKEN (non-ASCII text costs more per character); a per-model
+# factor learned from the exact usage_metadata of real responses corrects it over time.
+CHARS_PER_TOKEN = 4
+TOKEN_CALIBRATION_FILE = os.getenv("TOKEN_CALIBRATION_FILE", "./.token_calibration.json")
+
+# Weight of the newest observation in the running calibration factor
+CALIBRATION_RATE = 0.2
+
+_calibration = None
+# Serializes calibration updates between the threads of this process
+_lock = threading.Lock()
+
+
+def _factors():
+    global _calibration
+    if _calibration is None:
+        try:
+            with open(TOKEN_CALIBRATION_FILE, 'r', encoding='utf-8') as calibration_file:
+                _calibration = json.load(calibration_file)
+        except (OSError, ValueError):
+            _calibration = {}
+    return _calibration
+
+
+def _factor(model_name):
+    return _factors().get((model_name or "").split("/")[-1], 1.0)
+
+
+def _raw_tokens(text):
+    if text.isascii():
+        return len(text) / CHARS_PER_TOKEN
+    # Multi-byte characters (CJK, emoji, ...) are close to a token each
+    extra_bytes = len(text.encode('utf-8')) - len(text)
+    return len(text) / CHARS_PER_TOKEN + extra_bytes / 2
+
+
+def _raw_prompt_tokens(prompt):
+    if isinstance(prompt, str):
+        return _raw_tokens(prompt)
+    return sum(_raw_tokens(part) for part in prompt)
+
+
+def estimate_tokens(text, model_name=None):
+    return int(_raw_tokens(text) * _factor(model_name)) + 1
+
+
+# Estimate for a prompt given as a string or a list of parts
+def estimate_prompt_tokens(prompt, model_name=None):
+    return int(_raw_prompt_tokens(prompt) * _factor(model_name)) + 1
+
+
+# Estimate for a file known only by its size in bytes
+def estimate_size_tokens(size, model_name=None):
+    return int(size / CHARS_PER_TOKEN * _factor(model_name)) + 1
+
+
+# Fold the exact prompt token count reported by Gemini into the model's calibration factor
+def calibrate(model_name, prompt, actual_tokens):
+    raw = _raw_prompt_tokens(prompt)
+    if not actual_tokens or raw < 100:
+        return
+    model = (model_name or "").split("/")[-1]
+    ratio = min(max(actual_tokens / raw, 0.25), 4.0)
+    with _lock:
+        factors = _factors()
+        factors[model] = (1 - CALIBRATION_RATE) * factors.get(model, 1.0) + CALIBRATION_RATE * ratio
+        tmp_path = f"{TOKEN_CALIBRATION_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as calibration_file:
+            json.dump(factors, calibration_file)
+        os.replace(tmp_path, TOKEN_CALIBRATION_FILE)
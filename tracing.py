@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Timing spans and counters for the pipeline stages (clone, history, ingestion, prompt building,
+# Gemini calls, email). Finished spans are appended to TRACE_FILE as JSON lines and summed into
+# Prometheus counters, served on METRICS_HOST:METRICS_PORT by start_metrics_server() when the port is set.
+TRACE_FILE = os.getenv("TRACE_FILE", "./.trace.jsonl")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Set to 0.0.0.0 to let a Prometheus server on another host scrape the counters
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Finished spans kept in memory for the timing panels
+RECENT_SPANS = 2000
+
+METRIC_PREFIX = "code_analyst"
+
+_local = threading.local()
+_lock = threading.Lock()
+_recent = deque(maxlen=RECENT_SPANS)
+# {(metric name, stage): value}
+_metrics = {}
+_server = None
+# Why the metrics server could not be started; it is not tried again
+_server_error = None
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = trace_id or self.span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.counters = {}
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def as_dict(self):
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent_id, "start": self.start, "duration": self.duration,
+            "attributes": self.attributes, "counters": self.counters, "error": self.error,
+        }
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+# The innermost open span on this thread, or None
+def current_span():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+# Time a stage. Spans opened inside it on the same thread become its children; pass trace_id to
+# join a trace started on another thread (e.g. a job submitted from a page).
+@contextmanager
+def span(name, trace_id=None, **attributes):
+    parent = current_span()
+    if parent is not None and trace_id is None:
+        trace_id = parent.trace_id
+    current = Span(name, trace_id, parent.span_id if parent else None, attributes)
+    _stack().append(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _stack().pop()
+        current.duration = time.time() - current.start
+        _finish(current)
+
+
+# Decorator running every call of a function in a span
+def traced(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Add to a counter of the current span (files, bytes, commits, tokens, retries, ...)
+def count(counter, value=1):
+    current = current_span()
+    if current is not None:
+        current.add(counter, value)
+
+
+def _finish(finished):
+    record = finished.as_dict()
+    with _lock:
+        _recent.append(record)
+        for metric, value in [("seconds", finished.duration), ("calls", 1)] + list(finished.counters.items()):
+            key = (metric, finished.name)
+            _metrics[key] = _metrics.get(key, 0) + value
+        if finished.error:
+            key = ("errors", finished.name)
+            _metrics[key] = _metrics.get(key, 0) + 1
+        if TRACE_FILE:
+            try:
+                with open(TRACE_FILE, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(json.dumps(record, default=str) + "\n")
+            except OSError as e:
+                print(f"Error writing trace: {e}")
+
+
+# Finished spans of one trace, oldest first
+def trace_spans(trace_id):
+    with _lock:
+        return [record for record in _recent if record["trace_id"] == trace_id]
+
+
+# Prometheus text exposition of the counters: <prefix>_<metric>_total{stage="..."}
+def metrics_text():
+    with _lock:
+        items = sorted(_metrics.items())
+    lines = []
+    for metric in sorted(set(metric for metric, _ in _metrics)):
+        name = f"{METRIC_PREFIX}_{metric}_total"
+        lines.append(f"# TYPE {name} counter")
+        for (item_metric, stage), value in items:
+            if item_metric == metric:
+                lines.append(f'{name}{{stage="{stage}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = metrics_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics on host:port (METRICS_HOST:METRICS_PORT by default) from a daemon thread, once
+# per process. Called by the Streamlit scripts; returns None when the port is taken.
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    global _server, _server_error
+    with _lock:
+        if _server is not None or _server_error is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            _server_error = str(e)
+            print(f"Error serving metrics on {host}:{port}: {e}")
+            return None
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on {host}:{port}")
+    return _server
+
+
+# Timing table for a trace, indented by nesting, in a Streamlit container (st.expander, st.container, ...)
+def show_timings(container, spans):
+    depth = {}
+    rows = []
+    for record in sorted(spans, key=lambda record: record["start"]):
+        depth[record["span_id"]] = depth.get(record["parent_id"], -1) + 1
+        counters = ", ".join(f"{key}={value}" for key, value in record["counters"].items())
+        rows.append(f"| {'&nbsp;' * 4 * depth[record['span_id']]}{record['name']} | {record['duration']:.2f}s | {counters} |")
+    container.markdown("| Stage | Time | Counters |\n|---|---|---|\n" + "\n".join(rows))
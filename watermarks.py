@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import threading
+
+# Per-repository watermark for the recurring reports: the last commit a report covered and a
+# compact summary of that report. The next report only reads the commits after the watermark
+# and gets the summary as context instead of the code it already saw.
+REPORT_STATE_FILE = os.getenv("REPORT_STATE_FILE", "./.report_state.json")
+# Longest summary kept from a report
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", 4000))
+
+_lock = threading.Lock()
+
+
+def _load():
+    try:
+        with open(REPORT_STATE_FILE, 'r', encoding='utf-8') as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Watermark of a repository as {"sha", "committed", "summary", "updated"}, or None before its
+# first report. "committed" is the commit's timestamp; watermarks saved before it was kept lack it.
+def load_watermark(repo_key):
+    with _lock:
+        return _load().get(repo_key)
+
+
+# Record that a report covering everything up to commit sha, committed at the given timestamp, was sent
+def save_watermark(repo_key, sha, committed, report_text):
+    with _lock:
+        state = _load()
+        state[repo_key] = {"sha": sha, "committed": committed, "summary": summarize_report(report_text), "updated": time.time()}
+        tmp_path = f"{REPORT_STATE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file, indent=2)
+        os.replace(tmp_path, REPORT_STATE_FILE)
+
+
+# The report without blank lines and code blocks, cut at SUMMARY_MAX_CHARS on a line boundary
+def summarize_report(text):
+    lines = []
+    size = 0
+    in_code = False
+    for line in text.splitlines():
+        if line.strip().startswith("```"):
+            in_code = not in_code
+            continue
+        if in_code or not line.strip():
+            continue
+        if size + len(line) + 1 > SUMMARY_MAX_CHARS:
+            break
+        lines.append(line.rstrip())
+        size += len(line) + 1
+    return "\n".join(lines)